@@ -0,0 +1,98 @@
+"""
+Compares collect_adobe_parts with the old implementation, which re-joined
+everything collected so far after every resource, on APP13 payloads with
+hundreds of Photoshop resources, and checks that the output is identical.
+
+    python -m benchmarks.bench_adobe_parts
+"""
+import random
+import time
+from struct import pack, unpack
+
+from iptcinfo3 import PADDING_RESOURCE_ID, PADDING_SIGNATURE, collect_adobe_parts
+
+from benchmarks.synthetic import app13_payload, iim_block, random_bytes
+
+
+def collect_adobe_parts_legacy(data):
+    length = len(data)
+    out = []
+    offset = len('Photoshop 3.0 ')
+    while offset < length:
+        (ostype, id1, id2) = unpack("!LBB", data[offset:offset + 6])
+        offset += 6
+        if offset >= length:
+            break
+        stringlen = unpack("B", data[offset:offset + 1])[0]
+        offset += 1
+        if offset >= length:
+            break
+        string = data[offset:offset + stringlen]
+        offset += stringlen
+        if (stringlen % 2 != 0):
+            offset += 1
+        if stringlen == 0:
+            offset += 1
+        if offset >= length:
+            break
+        size = unpack("!L", data[offset:offset + 4])[0]
+        offset += 4
+        if offset >= length:
+            break
+        var = data[offset:offset + size]
+        offset += size
+        if size % 2 != 0:
+            offset += 1
+        if ((id1 << 8 | id2) == PADDING_RESOURCE_ID and var.startswith(PADDING_SIGNATURE)
+                and not var[len(PADDING_SIGNATURE):].strip(b'\x00')):
+            continue
+        if not (id1 == 4 and id2 == 4):
+            out.append(pack("!LBB", ostype, id1, id2))
+            out.append(pack("B", stringlen))
+            out.append(string)
+            if stringlen == 0 or stringlen % 2 != 0:
+                out.append(pack("B", 0))
+            out.append(pack("!L", size))
+            out.append(var)
+            out = [b''.join(out)]
+            if size % 2 != 0 and len(out[0]) % 2 != 0:
+                out.append(pack("B", 0))
+    return b''.join(out)
+
+
+def make_payload(resources, size, seed=0):
+    """An APP13 payload with IIM data and `resources` other resources of
+    about `size` bytes each, every other one with an odd size."""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(resources):
+        data = random_bytes(rng, size + i % 2)
+        header = b'8BIM' + pack('!HHL', 0x07d0 + i % 100, 0, len(data))
+        parts.append(header + data + b'\x00' * (i % 2))
+    return app13_payload(iim_block(), b''.join(parts))
+
+
+def timed(func, data, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        began = time.perf_counter()
+        result = func(data)
+        best = min(best, time.perf_counter() - began)
+    return result, best
+
+
+def main(rounds=5):
+    # the first ones fit in a Jpeg APP13 segment, the last ones are
+    # Photoshop-file sized
+    for (resources, size) in ((100, 500), (300, 150), (1000, 40), (300, 10000), (2000, 2000)):
+        data = make_payload(resources, size)
+        (before, legacy) = timed(collect_adobe_parts_legacy, data, rounds)
+        (after, current) = timed(collect_adobe_parts, data, rounds)
+        assert before == after, 'outputs differ'
+        print('%5d resources of %5d bytes (%8d bytes)  '
+              'legacy: %8.2f ms | current: %6.2f ms  (%.0fx)'
+              % (resources, size, len(data), legacy * 1e3, current * 1e3, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Compares finding the IIM data of TIFF and Photoshop files by blindScan,
+as IPTCInfo used to, with the structured walks of tiffScan (the IFDs)
+and psdScan (the image resource section): time, read() calls and bytes
+read (including collectIIMInfo), and whether the right data was found.
+The IIM data of the TIFFs sits after the image data, so blindScan stops
+at any 0x1c 0x02 in the (random) pixels, and can't reach data past its
+819200 byte window.
+
+    python -m benchmarks.bench_format_scan
+"""
+import io
+import logging
+import time
+
+from iptcinfo3 import IPTCInfo, IPTCStats
+
+from benchmarks.synthetic import make_psd, make_tiff
+
+
+def scan(data, method, rounds=5):
+    best = float('inf')
+    for _ in range(rounds):
+        stats = IPTCStats()
+        info = IPTCInfo(None, lazy=True, stats=stats)
+        fh = stats.wrap(io.BytesIO(data))
+        began = time.perf_counter()
+        found = getattr(info, method)(fh)
+        best = min(best, time.perf_counter() - began)
+    if found:
+        info.collectIIMInfo(fh)
+    return info._data['keywords'] == [b'keyword %d' % i for i in range(10)], stats, best
+
+
+def main():
+    logging.getLogger('iptcinfo').setLevel(logging.ERROR)
+    files = []
+    for image_size in (100000, 700000, 10 << 20):
+        files.append(('TIFF', 'tiffScan', make_tiff(image_size=image_size)))
+        files.append(('BigTIFF', 'tiffScan', make_tiff(image_size=image_size, bigtiff=True)))
+        files.append(('PSD', 'psdScan', make_psd(image_size=image_size)))
+    files.append(('PSD', 'psdScan', make_psd(image_size=100000, color_mode_size=1000000)))
+    for (kind, structured, data) in files:
+        for method in ('blindScan', structured):
+            (found, stats, best) = scan(data, method)
+            print('%-8s %9d bytes  %-9s  right data: %-5s  %3d reads %8d bytes read  %8.3f ms'
+                  % (kind, len(data), method, found, stats.reads, stats.bytes_read, best * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compares the legacy byte-at-a-time marker walk (jpeg_next_marker and
+jpeg_skip_variable) with JpegScanner, counting read() calls per file and
+files/sec on unbuffered file handles.
+
+    python -m benchmarks.bench_marker_scan
+"""
+import os
+import tempfile
+import time
+
+from iptcinfo3 import SOS, JpegScanner, jpeg_next_marker, jpeg_skip_variable, ord3
+
+from benchmarks.synthetic import write_jpeg
+
+
+class CountingReader:
+    """Wraps a file handle and counts read() and seek() calls, and the
+    bytes read."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self.reads = 0
+        self.seeks = 0
+        self.bytes = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        data = self._fh.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readinto(self, buffer):
+        self.reads += 1
+        count = self._fh.readinto(buffer)
+        self.bytes += count or 0
+        return count
+
+    def seek(self, offset, whence=0):
+        self.seeks += 1
+        return self._fh.seek(offset, whence)
+
+    def tell(self):
+        return self._fh.tell()
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    def close(self):
+        self._fh.close()
+
+
+def walk_legacy(fh):
+    fh.read(2)
+    markers = []
+    while True:
+        marker = jpeg_next_marker(fh)
+        if marker is None:
+            break
+        markers.append(ord3(marker))
+        if ord3(marker) == SOS:
+            break
+        jpeg_skip_variable(fh)
+    return markers
+
+
+def walk_scanner(fh):
+    scanner = JpegScanner(fh)
+    scanner.read(2)
+    markers = []
+    while True:
+        marker = scanner.next_marker()
+        if marker is None:
+            break
+        markers.append(marker)
+        if marker == SOS:
+            break
+        scanner.skip_variable()
+    return markers
+
+
+def run(walk, paths, rounds):
+    reads = seeks = 0
+    results = []
+    began = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            with open(path, 'rb', buffering=0) as raw:
+                fh = CountingReader(raw)
+                results.append(walk(fh))
+                reads += fh.reads
+                seeks += fh.seeks
+    elapsed = time.perf_counter() - began
+    count = rounds * len(paths)
+    return results, reads / count, seeks / count, count / elapsed
+
+
+def main(rounds=20):
+    corpora = {
+        'plain': dict(app_segments=2),
+        'many segments': dict(app_segments=40),
+        '0xff fill runs': dict(app_segments=4, fill=256),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, kwargs in corpora.items():
+            paths = [write_jpeg(os.path.join(tmp, '%s-%d.jpg' % (name, i)), seed=i, **kwargs)
+                     for i in range(10)]
+            before = run(walk_legacy, paths, rounds)
+            after = run(walk_scanner, paths, rounds)
+            assert before[0] == after[0], 'marker sequences differ'
+            print('%-15s legacy: %7.1f reads %5.1f seeks %8.0f files/s | '
+                  'scanner: %5.1f reads %5.1f seeks %8.0f files/s'
+                  % ((name,) + before[1:] + after[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Throughput of read_many over a corpus of synthetic Jpegs, scaling the
+number of workers from 1 to the CPU count for both backends.
+
+    python -m benchmarks.bench_read_many [number of files]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from iptcinfo3 import IPTCInfo, read_many
+
+from benchmarks.synthetic import write_jpeg
+
+
+def worker_counts():
+    count, cpus = 1, os.cpu_count() or 1
+    while count < cpus:
+        yield count
+        count *= 2
+    yield cpus
+
+
+def timed(func):
+    began = time.perf_counter()
+    count = func()
+    return count / (time.perf_counter() - began)
+
+
+def main(files):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [write_jpeg(os.path.join(tmp, '%05d.jpg' % i),
+                            image_size=20000, keywords=20, seed=i)
+                 for i in range(files)]
+
+        def serial():
+            return len([IPTCInfo(path).to_dict() for path in paths])
+
+        print('serial IPTCInfo loop: %8.0f files/s' % timed(serial))
+        for backend in ('thread', 'process'):
+            for workers in worker_counts():
+                def parallel():
+                    return len(list(read_many(paths, workers=workers, backend=backend,
+                                              chunksize=32, ordered=False)))
+
+                print('%-7s x %2d workers: %8.0f files/s' % (backend, workers, timed(parallel)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,62 @@
+"""
+Peak Python memory and time of save_as on large synthetic Jpegs, compared
+with the old approach of reading the whole tail with
+jpeg_collect_file_parts and writing it back out.
+
+    python -m benchmarks.bench_save_memory [size in MiB ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from iptcinfo3 import IPTCInfo, jpeg_collect_file_parts
+
+from benchmarks.synthetic import write_large_jpeg
+
+
+def save_in_memory(info, src, dst):
+    with open(src, 'rb') as fh:
+        (start, end, adobe) = jpeg_collect_file_parts(fh)
+    with open(dst, 'wb') as out:
+        out.write(start)
+        out.write(info.photoshopIIMBlock(adobe, info.packedIIMData()))
+        out.write(end)
+
+
+def save_streaming(info, src, dst):
+    info.save_as(dst, options={'overwrite': True})
+
+
+def measure(save, info, src, dst):
+    tracemalloc.start()
+    began = time.perf_counter()
+    save(info, src, dst)
+    elapsed = time.perf_counter() - began
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main(sizes):
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            src = write_large_jpeg(os.path.join(tmp, 'src.jpg'), size << 20)
+            info = IPTCInfo(src)
+            info['headline'] = b'benchmark'
+            results = {}
+            for save in (save_in_memory, save_streaming):
+                dst = os.path.join(tmp, save.__name__ + '.jpg')
+                results[save.__name__] = measure(save, info, src, dst)
+            with open(os.path.join(tmp, 'save_in_memory.jpg'), 'rb') as a, \
+                    open(os.path.join(tmp, 'save_streaming.jpg'), 'rb') as b:
+                assert a.read() == b.read(), 'outputs differ'
+            print('%5d MiB  in memory: peak %8.1f MiB %6.2fs | streaming: peak %6.2f MiB %6.2fs'
+                  % ((size,)
+                     + (results['save_in_memory'][0] / 2 ** 20, results['save_in_memory'][1])
+                     + (results['save_streaming'][0] / 2 ** 20, results['save_streaming'][1])))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [16, 64, 200])
@@ -0,0 +1,73 @@
+"""
+Compares the set-backed UniqueList with the old one, which checked
+`value not in self` on every append, at 10k keywords: merging keyword
+lists, reading IIM data (collectIIMInfo) and packing it (packedIIMData).
+
+    python -m benchmarks.bench_unique_list [keywords]
+"""
+import io
+import logging
+import sys
+import time
+
+import iptcinfo3
+from iptcinfo3 import IPTCInfo, UniqueList
+
+from benchmarks.synthetic import iim_block
+
+
+class LegacyUniqueList(list):
+    def append(self, value):
+        if value not in self:
+            super().append(value)
+
+    def extend(self, values):
+        for v in values:
+            self.append(v)
+
+
+def merge(cls, keywords):
+    # a keyword-merging job: half of the candidates are already there
+    values = cls(keywords)
+    values.extend(keywords[::2])
+    values.extend(b'new %d' % i for i in range(len(keywords) // 2))
+    return values
+
+
+def read(iim):
+    # not a Jpeg, so this is a blindScan that finds the data after the
+    # zeros (at offset 0 it would count as not found)
+    return IPTCInfo(io.BytesIO(bytes(16) + iim))
+
+
+def timed(func, *args, rounds=3):
+    best = float('inf')
+    for _ in range(rounds):
+        began = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - began)
+    return result, best
+
+
+def main(count):
+    logging.getLogger('iptcinfo').setLevel(logging.ERROR)
+    keywords = [b'keyword %d' % i for i in range(count)]
+    iim = iim_block(count)
+    results = {}
+    for cls in (LegacyUniqueList, UniqueList):
+        iptcinfo3.UniqueList = cls
+        try:
+            (merged, merge_time) = timed(merge, cls, keywords)
+            (info, read_time) = timed(read, iim)
+            (packed, pack_time) = timed(info.packedIIMData)
+        finally:
+            iptcinfo3.UniqueList = UniqueList
+        results[cls] = (list(merged), list(info['keywords']), packed)
+        print('%-16s %d keywords  merge: %8.1f ms  '
+              'collectIIMInfo: %8.1f ms  packedIIMData: %8.1f ms'
+              % (cls.__name__, count, merge_time * 1e3, read_time * 1e3, pack_time * 1e3))
+    assert results[LegacyUniqueList] == results[UniqueList], 'results differ'
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
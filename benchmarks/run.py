@@ -0,0 +1,245 @@
+"""
+The benchmark suite: times the main read and write paths over the
+synthetic CORPORA and compares the results with a stored baseline.
+
+For every operation and corpus it reports files/sec, the bytes read and
+the read() and seek() calls per file, and the peak Python memory
+(tracemalloc) of one pass over the corpus.
+
+    python -m benchmarks.run                      # compare with baseline.json
+    python -m benchmarks.run --save-baseline      # record a new baseline
+    python -m benchmarks.run -o corpus -b my.json --files 5 --rounds 1
+
+The exit status is 1 if any metric regressed by more than --tolerance
+(--speed-tolerance for files/sec). Files/sec depends on the machine and
+is noisy, so record your own baseline before comparing; the call and
+byte counts do not.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import closing
+
+from iptcinfo3 import IPTCInfo
+
+from benchmarks.bench_marker_scan import CountingReader
+from benchmarks.synthetic import CORPORA, write_corpus
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# metric -> True if higher is better
+METRICS = {
+    'files_per_sec': True,
+    'bytes_read': False,
+    'reads': False,
+    'seeks': False,
+    'peak_kib': False,
+}
+
+
+class Counts:
+    """Opens counted file handles and sums their counters."""
+
+    def __init__(self):
+        self._handles = []
+
+    def open(self, path):
+        fh = CountingReader(open(path, 'rb'))
+        self._handles.append(fh)
+        return fh
+
+    def total(self, name):
+        return sum(getattr(fh, name) for fh in self._handles)
+
+
+# Operations: name -> (Jpegs only, prepare(path, tmp) -> state, run(state, counts)).
+# Only run() is measured.
+
+def _prepare_path(path, tmp):
+    return path
+
+
+def _run_jpeg_scan(path, counts):
+    with closing(counts.open(path)) as fh:
+        IPTCInfo(path, lazy=True).jpegScan(fh)
+
+
+def _run_blind_scan(path, counts):
+    with closing(counts.open(path)) as fh:
+        IPTCInfo(path, lazy=True).blindScan(fh)
+
+
+def _prepare_collect(path, tmp):
+    with open(path, 'rb') as fh:
+        IPTCInfo(path, lazy=True).scanToFirstIMMTag(fh)
+        return (path, fh.tell())
+
+
+def _run_collect(state, counts):
+    (path, offset) = state
+    with closing(counts.open(path)) as fh:
+        fh.seek(offset)
+        IPTCInfo(path, lazy=True).collectIIMInfo(fh)
+
+
+def _prepare_info(path, tmp):
+    return IPTCInfo(path)
+
+
+def _run_pack(info, counts):
+    info.packedIIMData()
+
+
+def _prepare_save(path, tmp):
+    info = IPTCInfo(path)
+    info['headline'] = b'benchmark'
+    return (info, path, os.path.join(tmp, 'saved-' + os.path.basename(path)))
+
+
+def _run_save(state, counts):
+    (info, path, out) = state
+    # read the source through a counted handle; the file name is kept for copystat
+    info._fobj = counts.open(path)
+    info.save_as(out, {'overwrite': True})
+
+
+OPERATIONS = {
+    'jpegScan': (True, _prepare_path, _run_jpeg_scan),
+    'blindScan': (False, _prepare_path, _run_blind_scan),
+    'collectIIMInfo': (False, _prepare_collect, _run_collect),
+    'packedIIMData': (False, _prepare_info, _run_pack),
+    'save_as': (True, _prepare_save, _run_save),
+}
+
+
+def measure(run, states, rounds, min_time=0.2):
+    """Times at least `rounds` passes over `states`, and more until
+    `min_time` seconds have passed, and reports the fastest pass."""
+    counts = Counts()
+    times = []
+    while len(times) < rounds or sum(times) < min_time:
+        began = time.perf_counter()
+        for state in states:
+            run(state, counts if not times else Counts())
+        times.append(time.perf_counter() - began)
+    calls = len(states)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for state in states:
+        run(state, Counts())
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        'files_per_sec': round(calls / min(times), 1),
+        'bytes_read': round(counts.total('bytes') / calls),
+        'reads': round(counts.total('reads') / calls, 1),
+        'seeks': round(counts.total('seeks') / calls, 1),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run_suite(directory, files, rounds, operations=None):
+    """Returns {operation: {corpus: metrics}}."""
+    corpora = write_corpus(directory, files)
+    out_dir = os.path.join(directory, 'out')
+    os.makedirs(out_dir, exist_ok=True)
+    results = {}
+    for name, (jpeg_only, prepare, run) in OPERATIONS.items():
+        if operations and name not in operations:
+            continue
+        for corpus, paths in corpora.items():
+            if jpeg_only and CORPORA[corpus].get('blind'):
+                continue
+            states = [prepare(path, out_dir) for path in paths]
+            metrics = results.setdefault(name, {})[corpus] = measure(run, states, rounds)
+            print('%-15s %-18s %9.1f files/s %10d B %6.1f reads %5.1f seeks %9.1f KiB peak'
+                  % ((name, corpus) + tuple(metrics[m] for m in METRICS)))
+    return results
+
+
+def compare(results, baseline, tolerance, speed_tolerance):
+    """Prints the metrics that got worse than `baseline` by more than
+    `tolerance` (a fraction; `speed_tolerance` for files/sec) and returns
+    how many did."""
+    regressions = 0
+    for name, corpora in results.items():
+        for corpus, metrics in corpora.items():
+            old = baseline.get(name, {}).get(corpus)
+            if old is None:
+                continue
+            for metric, higher_is_better in METRICS.items():
+                (now, then) = (metrics[metric], old.get(metric))
+                if not then:
+                    continue
+                change = (now - then) / then
+                allowed = speed_tolerance if metric == 'files_per_sec' else tolerance
+                if (-change if higher_is_better else change) > allowed:
+                    regressions += 1
+                    print('REGRESSION %-15s %-18s %-13s %12s -> %-12s (%+.0f%%)'
+                          % (name, corpus, metric, then, now, 100 * change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description=__doc__.split('\n\n')[1])
+    parser.add_argument('-b', '--baseline', default=BASELINE,
+                        help='baseline JSON file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed change before a metric counts as a regression '
+                             '(default: %(default)s)')
+    parser.add_argument('--speed-tolerance', type=float, default=0.5,
+                        help='allowed slowdown in files/sec (default: %(default)s)')
+    parser.add_argument('--files', type=int, default=10,
+                        help='files per corpus (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='least number of timed passes over each corpus '
+                             '(default: %(default)s)')
+    parser.add_argument('--operation', action='append', choices=sorted(OPERATIONS),
+                        help='only run this operation (repeatable)')
+    parser.add_argument('-o', '--corpus-dir', help='keep the generated corpus in this directory')
+    args = parser.parse_args(argv)
+
+    # blindScan and the non-Jpeg corpus log warnings on every file
+    logging.getLogger('iptcinfo').setLevel(logging.ERROR)
+
+    if args.corpus_dir:
+        os.makedirs(args.corpus_dir, exist_ok=True)
+        results = run_suite(args.corpus_dir, args.files, args.rounds, args.operation)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run_suite(tmp, args.files, args.rounds, args.operation)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'files': args.files, 'results': results}, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        print('baseline written to %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline at %s, run with --save-baseline first' % args.baseline)
+        return 0
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    if baseline.get('files') != args.files:
+        print('note: baseline was recorded with --files %s' % baseline.get('files'))
+    regressions = compare(results, baseline['results'], args.tolerance, args.speed_tolerance)
+    print('%d regression(s) against %s (Python %s, %s)'
+          % (regressions, args.baseline, baseline.get('python'), baseline.get('platform')))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
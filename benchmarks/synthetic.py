@@ -0,0 +1,183 @@
+"""
+Synthetic Jpeg, TIFF and Photoshop files for the benchmarks.
+
+The files have a valid marker structure, but the image data is random
+noise, so they are only good for exercising the metadata code.
+
+    python -m benchmarks.synthetic OUTDIR [files per corpus]
+
+writes the CORPORA used by the benchmark suite to OUTDIR.
+"""
+import os
+import random
+import sys
+from struct import pack
+
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+
+
+def random_bytes(rng, length):
+    if length == 0:
+        return b''
+    return rng.getrandbits(length * 8).to_bytes(length, 'little')
+
+
+def segment(marker, payload, fill=0):
+    """A marker segment, preceded by `fill` extra 0xff padding bytes."""
+    return b'\xff' * fill + pack('!BBH', 0xff, marker, len(payload) + 2) + payload
+
+
+def iim_dataset(dataset, value, record=2):
+    return pack('!BBBH', 0x1c, record, dataset, len(value)) + value
+
+
+def iim_block(keywords=10, caption=b'A synthetic caption', distinct_keywords=None):
+    """IIM record 2 data with a caption and `keywords` keywords, of which
+    only `distinct_keywords` differ, if given."""
+    distinct = distinct_keywords or keywords or 1
+    parts = [iim_dataset(0, b'\x00\x04'), iim_dataset(120, caption)]
+    parts.extend(iim_dataset(25, b'keyword %d' % (i % distinct)) for i in range(keywords))
+    return b''.join(parts)
+
+
+def photoshop_resource(resource_id, data, name=b''):
+    name = pack('B', len(name)) + name
+    if len(name) % 2:
+        name += b'\x00'
+    if len(data) % 2:
+        data += b'\x00'
+    return b'8BIM' + pack('!H', resource_id) + name + pack('!L', len(data)) + data
+
+
+def app13_payload(iim, resources=b''):
+    return b'Photoshop 3.0\x00' + photoshop_resource(0x0404, iim) + resources
+
+
+def make_jpeg(image_size=100000, app_segments=2, keywords=10, fill=0,
+              app13_resources=b'', distinct_keywords=None, seed=0):
+    """Builds a Jpeg with `app_segments` APPn blocks, an APP13 holding
+    `keywords` keywords, the usual tables and `image_size` bytes of
+    scan data. `fill` 0xff bytes are put in front of every marker."""
+    rng = random.Random(seed)
+    out = [SOI, segment(0xe0, b'JFIF\x00\x01\x02' + bytes(9), fill)]
+    for i in range(app_segments):
+        out.append(segment(0xe1 + i % 12, random_bytes(rng, 1000), fill))
+    iim = iim_block(keywords, distinct_keywords=distinct_keywords)
+    out.append(segment(0xed, app13_payload(iim, app13_resources), fill))
+    out.append(segment(0xdb, b'\x00' + random_bytes(rng, 64), fill))
+    out.append(segment(0xc0, b'\x08\x01\x00\x01\x00\x03\x01\x11\x00\x02\x11\x01\x03\x11\x01', fill))
+    out.append(segment(0xc4, b'\x00' + random_bytes(rng, 28), fill))
+    out.append(segment(0xda, b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00', fill))
+    out.append(random_bytes(rng, image_size).replace(b'\xff', b'\xff\x00'))
+    out.append(EOI)
+    return b''.join(out)
+
+
+def write_jpeg(path, **kwargs):
+    with open(path, 'wb') as fh:
+        fh.write(make_jpeg(**kwargs))
+    return path
+
+
+def write_large_jpeg(path, image_size, seed=0, block_size=1 << 20):
+    """Like write_jpeg, but streams `image_size` bytes of scan data to
+    disk by repeating a random block, so huge files are cheap to make."""
+    rng = random.Random(seed)
+    head = make_jpeg(image_size=0, seed=seed)[:-len(EOI)]
+    block = random_bytes(rng, block_size).replace(b'\xff', b'\xfe')
+    with open(path, 'wb') as fh:
+        fh.write(head)
+        for _ in range(image_size // block_size):
+            fh.write(block)
+        fh.write(block[:image_size % block_size])
+        fh.write(EOI)
+    return path
+
+
+def make_blind(size=200000, offset=150000, keywords=10, seed=0):
+    """A non-Jpeg file with IIM data `offset` bytes in, for blindScan. The
+    noise around it has no 0x1c bytes, so there are no false starts."""
+    rng = random.Random(seed)
+    noise = random_bytes(rng, size).replace(b'\x1c', b'\x1d')
+    return noise[:offset] + iim_block(keywords) + noise[offset:]
+
+
+def make_tiff(image_size=2000000, keywords=10, byteorder='<', bigtiff=False, photoshop=False,
+              seed=0):
+    """A TIFF (or BigTIFF) with `image_size` bytes of noise, followed by
+    the IIM data, in the IPTC-NAA tag or else in a Photoshop tag, and the
+    IFD, as many writers lay them out."""
+    rng = random.Random(seed)
+    image = random_bytes(rng, image_size)
+    payload = iim_block(keywords)
+    if photoshop:
+        payload = photoshop_resource(0x040c, bytes(100)) + photoshop_resource(0x0404, payload)
+    (tag, type_) = (34377, 1) if photoshop else (33723, 7)
+    header_size = 16 if bigtiff else 8
+    data_offset = header_size + image_size
+    ifd = data_offset + len(payload) + len(payload) % 2
+    mark = b'II' if byteorder == '<' else b'MM'
+    if bigtiff:
+        header = mark + pack(byteorder + 'HHHQ', 43, 8, 0, ifd)
+        (count, entry, next_ifd) = ('Q', 'HHQQ', 'Q')
+    else:
+        header = mark + pack(byteorder + 'HL', 42, ifd)
+        (count, entry, next_ifd) = ('H', 'HHLL', 'L')
+    entries = [
+        (256, 4, 1, 1000),  # ImageWidth, inline
+        (273, 4, 1, header_size),  # StripOffsets
+        (279, 4, 1, image_size),  # StripByteCounts
+        (tag, type_, len(payload), data_offset),
+    ]
+    return (header + image + payload + b'\x00' * (len(payload) % 2)
+            + pack(byteorder + count, len(entries))
+            + b''.join(pack(byteorder + entry, *e) for e in entries)
+            + pack(byteorder + next_ifd, 0))
+
+
+def make_psd(image_size=2000000, keywords=10, color_mode_size=768, psb=False, seed=0):
+    """A Photoshop file (PSB with `psb`) with `color_mode_size` bytes of
+    color mode data, an image resource section holding a thumbnail and
+    the IIM data, and `image_size` bytes of noise as the layer and image
+    data."""
+    rng = random.Random(seed)
+    header = b'8BPS' + pack('!H6xHLLHH', 2 if psb else 1, 3, 1000, 1000, 8, 3)
+    resources = (photoshop_resource(0x040c, random_bytes(rng, 20000))
+                 + photoshop_resource(0x0404, iim_block(keywords)))
+    return (header + pack('!L', color_mode_size) + random_bytes(rng, color_mode_size)
+            + pack('!L', len(resources)) + resources + random_bytes(rng, image_size))
+
+
+CORPORA = {
+    'small': dict(image_size=20000),
+    'large image': dict(image_size=8 << 20),
+    'many app segments': dict(app_segments=60),
+    'large app13': dict(app13_resources=photoshop_resource(0x040c, bytes(60000))),
+    'many keywords': dict(keywords=3000),
+    'repeated keywords': dict(keywords=3000, distinct_keywords=30),
+    '0xff fill runs': dict(fill=1024),
+    'blind scan': dict(blind=True),
+}
+
+
+def write_corpus(directory, files=10, corpora=CORPORA):
+    """Writes `files` files for each corpus to `directory`. Returns a dict
+    of corpus name -> list of paths."""
+    out = {}
+    for name, kwargs in corpora.items():
+        kwargs = dict(kwargs)
+        make = make_blind if kwargs.pop('blind', False) else make_jpeg
+        paths = out[name] = []
+        for i in range(files):
+            path = os.path.join(directory, '%s-%03d.%s' % (
+                name.replace(' ', '_'), i, 'bin' if make is make_blind else 'jpg'))
+            with open(path, 'wb') as fh:
+                fh.write(make(seed=i, **kwargs))
+            paths.append(path)
+    return out
+
+
+if __name__ == '__main__':
+    os.makedirs(sys.argv[1], exist_ok=True)
+    write_corpus(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10)
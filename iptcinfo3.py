@@ -17,13 +17,29 @@
 """
 IPTCInfo - Python module for extracting and modifying IPTC image meta-data
 """
+import argparse
+import asyncio
 import contextlib
+import csv
+import functools
+import hashlib
+import io
+import itertools
 import logging
+import marshal
 import os
+import re
 import shutil
+import sqlite3
 import sys
 import tempfile
-from struct import pack, unpack
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from struct import pack, unpack, unpack_from
 import json
 
 __version__ = '2.3.0'
@@ -31,6 +47,8 @@ __author__ = 'Gulácsi, Tamás'
 __updated_by__ = 'Campbell, James'
 
 SURELY_WRITE_CHARSET_INFO = False
+# What save_as returns when the file already holds the data
+UNCHANGED = 'unchanged'
 debugMode = 0
 #  Debug off for production use
 
@@ -46,6 +64,30 @@ COM = 0xfe  # Comment
 SOS = 0xda  # Start of scan
 EOI = 0xd9  # End of image
 
+JPEG_SCAN_CHUNK = 4096  # first block size read by JpegScanner
+JPEG_SCAN_MAX_CHUNK = 65536  # JpegScanner doubles its block size up to this
+COPY_CHUNK = 1048576  # block size used by copy_tail when it can't use the kernel
+
+# Inserted when application parts are discarded, since all JFIF format
+# images should start with the version block.
+JFIF_APP0 = b''.join([
+    pack("BB", 0xff, APP0),
+    pack("!H", 16),  # length (including these 2 bytes)
+    b'JFIF',  # format
+    pack("BB", 1, 2),  # call it version 1.2 (current JFIF)
+    pack('8B', 0, 0, 0, 0, 0, 0, 0, 0),  # zero everything else
+])
+
+# Photoshop resource holding the slack reserved for in-place saves. 0x0fff
+# is in the plug-in range too, so only resources with this id whose data is
+# PADDING_SIGNATURE followed by zeros are treated as (our) padding.
+PADDING_RESOURCE_ID = 0x0fff
+PADDING_SIGNATURE = b'iptcinfo3 padding\x00'
+# the smallest padding resource: header, empty name, size and signature
+PADDING_MIN_SIZE = 12 + len(PADDING_SIGNATURE)
+# Photoshop resource holding the IIM data
+IIM_RESOURCE_ID = 0x0404
+
 
 # Misc utilities
 ################
@@ -100,13 +142,137 @@ def hex_dump(dump):
     return ''.join(res)
 
 
+class HexDump:
+    """Formats `data` with hex_dump only when converted to a string, so it
+    can be passed to a logging call that may never be emitted."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return hex_dump(self.data)
+
+
+class IPTCStats:
+    """
+    Per-phase timings and I/O counters of IPTCInfo operations.
+
+    Pass one as IPTCInfo(..., stats=IPTCStats()) and it collects, over all
+    reads and saves of that object, the seconds spent in each phase
+    ('jpegScan', 'tiffScan', 'psdScan', 'blindScan', 'collectIIMInfo',
+    'inplace', 'header', 'packedIIMData', 'write', 'move'), the read() and
+    seek() calls and bytes read on the source, and the bytes written.
+    `bytes_copied` is the part of `bytes_written` copied unchanged from the
+    source (the image data). `saves` counts the files written and
+    `saves_skipped` the saves that had nothing to write.
+
+    `callback(phase, seconds)` is called after every phase, e.g. to feed
+    a metrics library. Not thread safe: use one per thread.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = {}
+        self.calls = {}
+        self.reads = 0
+        self.seeks = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.bytes_copied = 0
+        self.saves = 0
+        self.saves_skipped = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - began)
+
+    def record(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    def wrap(self, fh):
+        """Returns `fh` with its reads and seeks counted."""
+        if hasattr(fh, 'getbuffer'):
+            return _CountedBuffer(fh, self)
+        return _CountedFile(fh, self)
+
+    def to_dict(self):
+        return {
+            'phases': dict(self.phases), 'calls': dict(self.calls),
+            'reads': self.reads, 'seeks': self.seeks, 'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written, 'bytes_copied': self.bytes_copied,
+            'saves': self.saves, 'saves_skipped': self.saves_skipped,
+        }
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+
+class _CountedFile:
+    """A file handle wrapper counting into an IPTCStats."""
+
+    def __init__(self, fh, stats):
+        self._fh = fh
+        self._stats = stats
+
+    def read(self, size=-1):
+        data = self._fh.read(size)
+        self._stats.reads += 1
+        self._stats.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = self._fh.readinto(buffer)
+        self._stats.reads += 1
+        self._stats.bytes_read += count or 0
+        return count
+
+    def write(self, data):
+        written = self._fh.write(data)
+        self._stats.bytes_written += len(data)
+        return written
+
+    def seek(self, offset, whence=0):
+        self._stats.seeks += 1
+        return self._fh.seek(offset, whence)
+
+    def tell(self):
+        return self._fh.tell()
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    def close(self):
+        self._fh.close()
+
+
+class _CountedBuffer(_CountedFile):
+    """_CountedFile for in-memory files, keeping getbuffer(), so that
+    copy_tail can still write out their data without copying it."""
+
+    def getbuffer(self):
+        """The whole buffer, counted as one read of all of it."""
+        view = self._fh.getbuffer()
+        self._stats.reads += 1
+        self._stats.bytes_read += view.nbytes
+        return view
+
+
 # File utilities
 ################
 # Should we just use .read and .seek?
 
 class EOFException(Exception):
     def __init__(self, *args):
-        super().__init__(self)
+        super().__init__(*args)
         self._str = '\n'.join(args)
 
     def __str__(self):
@@ -134,6 +300,167 @@ def seek_exactly(fh, length):
         raise EOFException('seek_exactly')
 
 
+def fsync_directory(path):
+    """
+    Flushes the directory entries of `path` (e.g. a rename) to disk, where
+    the platform can open directories (not on Windows).
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def backup_file(path, hardlink=False):
+    """
+    Keeps the current version of `path` as `path~`, replacing an older
+    backup: as a hard link to the same data if `hardlink` is true and the
+    file system supports it, else as a copy.
+    """
+    backup = path + '~'
+    if hardlink:
+        try:
+            if os.path.lexists(backup):
+                os.unlink(backup)
+            os.link(path, backup)
+            return backup
+        except OSError as err:
+            logger.info('backup_file: no hard link (%s), copying', err)
+    shutil.copy2(path, backup)
+    return backup
+
+
+class _BufferReader:
+    """A read-only file object over a bytes-like object, which read()
+    slices without copying the rest of it."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        """A memoryview of the whole buffer, like BytesIO.getbuffer()."""
+        return self._view[:]
+
+    def close(self):
+        pass
+
+
+class _HashWriter:
+    """A write-only file object that just hashes what is written to it."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def digest(self):
+        return self._hash.digest()
+
+
+def file_signature(fh):
+    """Returns (size, mtime_ns, inode) of an open file, to tell whether it
+    changed since, or None for file-like objects."""
+    try:
+        st = os.fstat(fh.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _fd_copiers():
+    """Kernel-side copy functions available on this platform, as
+    f(src_fd, dst_fd, offset, count) -> bytes copied."""
+    if hasattr(os, 'copy_file_range'):
+        yield lambda src, dst, offset, count: os.copy_file_range(src, dst, count, offset)
+    if hasattr(os, 'sendfile'):
+        yield lambda src, dst, offset, count: os.sendfile(dst, src, offset, count)
+
+
+def copy_tail(src, dst, offset):
+    """
+    Copies everything from `offset` to the end of `src` to the current
+    position of `dst`, and returns the number of bytes copied.
+
+    When both are real files the data is copied with os.copy_file_range or
+    os.sendfile without passing through Python. An in-memory `src` (with a
+    getbuffer() method, like BytesIO) is written out in one go. Otherwise
+    (or if the kernel refuses) it is copied in COPY_CHUNK sized blocks.
+    """
+    if hasattr(src, 'getbuffer'):
+        with src.getbuffer() as view, view[offset:] as tail:
+            dst.write(tail)
+            return len(tail)
+
+    copied = 0
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        dst.flush()
+        # fails on pipes, which the kernel copy would write to just as well,
+        # but then the file object couldn't be told where it is
+        dst_start = dst.tell()
+    except (AttributeError, OSError, ValueError):
+        src_fd = dst_fd = None
+
+    if src_fd is not None:
+        remaining = os.fstat(src_fd).st_size - offset
+        for copier in _fd_copiers():
+            try:
+                while remaining > 0:
+                    count = copier(src_fd, dst_fd, offset + copied, remaining)
+                    if count == 0:
+                        break
+                    copied += count
+                    remaining -= count
+            except OSError as err:
+                LOGDBG.debug('copy_tail: falling back from %r: %s', copier, err)
+                continue
+            break
+        # the buffered file object doesn't know the fd moved
+        dst.seek(dst_start + copied)
+        if remaining <= 0:
+            return copied
+
+    src.seek(offset + copied)
+    while True:
+        buff = src.read(COPY_CHUNK)
+        if not buff:
+            break
+        dst.write(buff)
+        copied += len(buff)
+
+    return copied
+
+
 # JPEG utilities
 ################
 
@@ -238,6 +565,326 @@ def jpeg_skip_variable(fh, rSave=None):
     return (rSave is not None and [temp] or [True])[0]
 
 
+_MARKER_RE = re.compile(b'\xff+[^\xff]')
+
+
+class JpegScanner:
+    """Buffered walker over the markers of a Jpeg file.
+
+    Reads the header region in blocks and finds markers with a bytes
+    search, instead of reading one byte at a time like jpeg_next_marker
+    does. The first block is `chunk_size` bytes, so small headers cost a
+    single small read; every further block is twice as large, up to
+    `max_chunk_size`. Segments that don't fit in the buffer are skipped
+    with a single seek.
+
+    The position of the underlying file handle is undefined while
+    scanning; call sync() to move it to the scanner's logical position.
+    """
+
+    def __init__(self, fh, chunk_size=JPEG_SCAN_CHUNK, max_chunk_size=JPEG_SCAN_MAX_CHUNK):
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._max_chunk_size = max(chunk_size, max_chunk_size)
+        # file offset of self._buf[0]; the handle is always positioned
+        # right after the buffered bytes
+        self._base = fh.tell()
+        self._buf = b''
+        self._pos = 0
+
+    def tell(self):
+        """Returns the logical file position of the scanner."""
+        return self._base + self._pos
+
+    def _fill(self, want):
+        """Makes sure at least `want` bytes are buffered after the
+        current position. Returns False if EOF is hit first."""
+        if len(self._buf) - self._pos >= want:
+            return True
+
+        self._base += self._pos
+        parts = [self._buf[self._pos:]]
+        have = len(parts[0])
+        self._pos = 0
+        while have < want:
+            chunk = self._fh.read(max(self._chunk_size, want - have))
+            if not chunk:
+                break
+            parts.append(chunk)
+            have += len(chunk)
+            self._chunk_size = min(2 * self._chunk_size, self._max_chunk_size)
+
+        self._buf = b''.join(parts)
+        return have >= want
+
+    def next_marker(self):
+        """Scans to the start of the next valid-looking marker, skipping
+        any 0xff padding. Returns the marker id as an int, or None at EOF."""
+        while True:
+            # Leave out a trailing run of 0xffs, whose marker id is in the
+            # next block: the regex would backtrack over all of it at every
+            # position of it.
+            end = len(self._buf)
+            if self._buf.endswith(b'\xff'):
+                end = len(self._buf.rstrip(b'\xff'))
+            m = _MARKER_RE.search(self._buf, self._pos, end)
+            if m is not None:
+                self._pos = m.end()
+                marker = self._buf[self._pos - 1]
+                logger.debug("JpegScanner: at marker %02X (%d)", marker, marker)
+                return marker
+
+            # Keep the trailing run of 0xffs, if any
+            self._pos = max(self._pos, end)
+            if not self._fill(len(self._buf) - self._pos + 1):
+                return None
+
+    def read_length(self):
+        """Same as jpeg_get_variable_length, from the buffer."""
+        if not self._fill(2):
+            return 0
+        length = unpack('!H', self._buf[self._pos:self._pos + 2])[0]
+        self._pos += 2
+        logger.debug('JPEG variable length: %d', length)
+
+        # Length includes itself, so must be at least 2
+        if length < 2:
+            logger.warning("JpegScanner: erroneous JPEG marker length")
+            return 0
+        return length - 2
+
+    def read(self, length):
+        """Reads exactly `length` bytes and throws an exception if EOF is hit."""
+        if not self._fill(length):
+            raise EOFException('JpegScanner.read: %s' % str(self._fh))
+        data = self._buf[self._pos:self._pos + length]
+        self._pos += length
+        return data
+
+    def read_upto(self, length):
+        """Reads `length` bytes, or fewer at EOF, like fh.read(length).
+        If the file has readinto(), what isn't buffered yet is read
+        straight into the result, a bytearray then, instead of going
+        through the buffer."""
+        have = len(self._buf) - self._pos
+        if have >= length or not hasattr(self._fh, 'readinto'):
+            self._fill(length)
+            data = self._buf[self._pos:self._pos + length]
+            self._pos += len(data)
+            return data
+
+        data = bytearray(length)
+        with memoryview(data) as view:
+            view[:have] = memoryview(self._buf)[self._pos:]
+            got = have
+            while got < length:
+                count = self._fh.readinto(view[got:])
+                if not count:
+                    break
+                got += count
+        del data[got:]
+        # the handle is right after `data` now
+        self._base += self._pos + got
+        self._buf = b''
+        self._pos = 0
+        return data
+
+    def skip(self, length):
+        """Skips `length` bytes, seeking if they are not buffered."""
+        if len(self._buf) - self._pos >= length:
+            self._pos += length
+            return
+
+        target = self.tell() + length
+        self._fh.seek(target)
+        self._base = target
+        self._buf = b''
+        self._pos = 0
+
+    def read_variable(self):
+        """Reads the variable-length section of the current marker.
+        Returns None on failure, like jpeg_skip_variable(fh, rSave)."""
+        length = self.read_length()
+        if length == 0:
+            return None
+        try:
+            return self.read(length)
+        except EOFException:
+            logger.error("JpegScanner: read failed while reading var data")
+            return None
+
+    def skip_variable(self):
+        """Skips the variable-length section of the current marker."""
+        self.skip(self.read_length())
+
+    def sync(self):
+        """Moves the file handle to the scanner's logical position."""
+        pos = self.tell()
+        self._fh.seek(pos)
+        self._base = pos
+        self._buf = b''
+        self._pos = 0
+
+
+class JpegSegmentIndex:
+    """Index of the marker segments of a Jpeg file, up to the image data.
+
+    Keeps the marker id, file offset (of the 0xff in front of the marker)
+    and payload length (without the length field) of every segment in
+    compact arrays. Iterating yields (marker, offset, length) tuples.
+
+    `end` is the offset of the SOS or EOI marker that ended the scan, or
+    None if it ran into EOF or garbage first; `end_marker` is the marker
+    that ended it (None on EOF). `signature` is the file_signature() of
+    the scanned file. `resume` is the offset to go on from if the walk
+    stopped early (see jpeg_segment_index), and None otherwise.
+    """
+    __slots__ = ('markers', 'offsets', 'lengths', 'end', 'end_marker', 'signature', 'resume')
+
+    def __init__(self):
+        self.markers = array('B')
+        self.offsets = array('Q')
+        self.lengths = array('H')
+        self.end = None
+        self.end_marker = None
+        self.signature = None
+        self.resume = None
+
+    def append(self, marker, offset, length):
+        self.markers.append(marker)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def __len__(self):
+        return len(self.markers)
+
+    def __getitem__(self, i):
+        return (self.markers[i], self.offsets[i], self.lengths[i])
+
+    def __iter__(self):
+        return zip(self.markers, self.offsets, self.lengths)
+
+    def __repr__(self):
+        return '<JpegSegmentIndex %s end=%s>' % (
+            ' '.join('%02X@%d+%d' % segment for segment in self), self.end)
+
+    def find_all(self, marker):
+        """Returns (offset, length) of every segment with this marker."""
+        return [(offset, length) for (m, offset, length) in self if m == marker]
+
+    def find(self, marker):
+        """Returns (offset, length) of the first segment with this marker, or None."""
+        try:
+            i = self.markers.index(marker)
+        except ValueError:
+            return None
+        return (self.offsets[i], self.lengths[i])
+
+    def read(self, fh, i):
+        """Reads the payload of the i-th segment from `fh`."""
+        fh.seek(self.offsets[i] + 4)
+        return read_exactly(fh, self.lengths[i])
+
+    def finish(self, fh):
+        """Goes on with a walk that stopped early up to the image data.
+        `fh` must be the same, unchanged file. Returns the index."""
+        if self.resume is not None:
+            fh.seek(self.resume)
+            _walk_segments(JpegScanner(fh), self, None)
+        return self
+
+
+def jpeg_segment_index(fh, until=None):
+    """Walks the markers of a Jpeg file up to the image data in a single
+    pass. Returns a JpegSegmentIndex, or None if the file doesn't start
+    with SOI.
+
+    If `until` is a marker, the walk stops at the first segment with it
+    (which is in the index), for callers that don't need the rest;
+    index.finish(fh) completes it."""
+    return _jpeg_segment_scan(fh, until)[0]
+
+
+def _jpeg_segment_scan(fh, until):
+    """jpeg_segment_index, returning (index, scanner). If the walk stopped
+    at the `until` segment, the scanner is at the start of its payload."""
+    fh.seek(0)
+    scanner = JpegScanner(fh)
+    (ff, soi) = scanner.read(2)
+    if not (ff == 0xff and soi == SOI):
+        return (None, scanner)
+
+    index = JpegSegmentIndex()
+    index.signature = file_signature(fh)
+    return (_walk_segments(scanner, index, until), scanner)
+
+
+def _walk_segments(scanner, index, until):
+    """Adds the segments from the position of `scanner` on to `index`, up
+    to the image data or the first `until` segment."""
+    index.resume = None
+    while True:
+        marker = scanner.next_marker()
+        if marker is None or marker == 0 or marker == SOS or marker == EOI:
+            index.end_marker = marker
+            if marker == SOS or marker == EOI:
+                index.end = scanner.tell() - 2
+            return index
+
+        offset = scanner.tell() - 2
+        length = scanner.read_length()
+        index.append(marker, offset, length)
+        if marker == until:
+            index.resume = scanner.tell() + length
+            return index
+        scanner.skip(length)
+
+
+def _header_parts_from_index(fh, index, discard_app_parts):
+    """jpeg_collect_header_parts for a file whose segment index we have.
+    Returns None for anything unusual, which is left to the marker scan."""
+    segments = list(index)
+    if not segments or segments[0][0] not in (APP0, APP1) or segments[0][2] == 0:
+        return None
+
+    kept = []
+    app13 = None
+    for (marker, offset, length) in segments[1:]:
+        if length == 0:
+            return None
+        if discard_app_parts and marker >= APP0 and marker <= 0xef:
+            continue
+        if marker == APP13:
+            app13 = (offset, length)
+            break
+        kept.append((offset, length))
+
+    if app13 is not None:
+        tail_offset = app13[0] + 4 + app13[1]
+    elif index.end is not None:
+        tail_offset = index.end
+    else:
+        return None
+
+    start = [pack('BB', 0xff, SOI)]
+    (marker, offset, length) = segments[0]
+    if marker == APP0 or not discard_app_parts:
+        kept.insert(0, (offset, length))
+    else:
+        start.append(JFIF_APP0)
+
+    # Read everything from the first segment we keep in one go
+    first = kept[0][0] if kept else tail_offset
+    fh.seek(first)
+    span = read_exactly(fh, tail_offset - first)
+    start.extend(span[offset - first:offset - first + length + 4] for (offset, length) in kept)
+    adobe = b''
+    if app13 is not None:
+        adobe = collect_adobe_parts(span[app13[0] + 4 - first:])
+
+    return (b''.join(start), tail_offset, adobe)
+
+
 def jpeg_collect_file_parts(fh, discard_app_parts=False):
     """
     Collect all pieces of the file except for the IPTC info that we'll replace when saving.
@@ -249,28 +896,69 @@ def jpeg_collect_file_parts(fh, discard_app_parts=False):
 
     Returns None if a file parsing error occured.
     """
+    parts = jpeg_collect_header_parts(fh, discard_app_parts)
+    if parts is None:
+        return None
+
+    (start, tail_offset, adobeParts) = parts
+    end = []
+    fh.seek(tail_offset)
+    while True:
+        buff = fh.read(8192)
+        if buff is None or len(buff) == 0:
+            break
+
+        end.append(buff)
+
+    return (start, b''.join(end), adobeParts)
+
+
+def jpeg_collect_header_parts(fh, discard_app_parts=False, index=None):
+    """
+    Like jpeg_collect_file_parts, but instead of reading the stuff after
+    the info, returns the offset where it starts, so it can be copied
+    with copy_tail.
+
+    `index` is the file's JpegSegmentIndex, if already known. It may have
+    stopped at APP13.
+
+    Returns:
+    start: the stuff before the info
+    tail_offset: the file offset of the stuff after the info
+    adobe: the contents of the Adobe Resource Block that the IPTC data goes in
+    """
+    if index is None:
+        index = jpeg_segment_index(fh)
+    if index is not None:
+        if discard_app_parts:
+            # the segments after APP13 are kept too
+            index.finish(fh)
+        parts = _header_parts_from_index(fh, index, discard_app_parts)
+        if parts is not None:
+            return parts
+
     adobeParts = b''
     start = []
     fh.seek(0)
-    (ff, soi) = fh.read(2)
-    if not (ord3(ff) == 0xff and ord3(soi) == SOI):
+    scanner = JpegScanner(fh)
+    (ff, soi) = scanner.read(2)
+    if not (ff == 0xff and soi == SOI):
         raise Exception('invalid start of file, is it a Jpeg?')
 
     # Begin building start of file
     start.append(pack('BB', 0xff, SOI))  # pack('BB', ff, soi)
 
     # Get first marker. This *should* be APP0 for JFIF or APP1 for EXIF
-    marker = ord(jpeg_next_marker(fh))
+    marker = scanner.next_marker()
     while marker != APP0 and marker != APP1:
         # print('bad first marker: %02X, skipping it' % marker)
-        marker = ord(jpeg_next_marker(fh))
+        marker = scanner.next_marker()
 
         if marker is None:
-            break
+            raise Exception('Marker scan failed')
 
     # print('first marker: %02X %02X' % (marker, APP0))
-    app0data = b''
-    app0data = jpeg_skip_variable(fh, app0data)
+    app0data = scanner.read_variable()
     if app0data is None:
         raise Exception('jpeg_skip_variable failed')
 
@@ -284,93 +972,69 @@ def jpeg_collect_file_parts(fh, discard_app_parts=False):
         # Manually insert APP0 if we're trashing application parts, since
         # all JFIF format images should start with the version block.
         LOGDBG.debug('discard_app_parts=%s', discard_app_parts)
-        start.append(pack("BB", 0xff, APP0))
-        start.append(pack("!H", 16))    # length (including these 2 bytes)
-        start.append(b'JFIF')  # format
-        start.append(pack("BB", 1, 2))  # call it version 1.2 (current JFIF)
-        start.append(pack('8B', 0, 0, 0, 0, 0, 0, 0, 0))  # zero everything else
+        start.append(JFIF_APP0)
 
     # Now scan through all markers in file until we hit image data or
     # IPTC stuff.
-    end = []
     while True:
-        marker = jpeg_next_marker(fh)
-        if marker is None or ord3(marker) == 0:
+        marker = scanner.next_marker()
+        if marker is None or marker == 0:
             raise Exception('Marker scan failed')
 
         # Check for end of image
-        elif ord3(marker) == EOI:
+        elif marker == EOI:
             logger.debug("jpeg_collect_file_parts: saw end of image marker")
-            end.append(pack("BB", 0xff, ord3(marker)))
+            # the tail starts with the marker (the last 0xff of any padding)
+            tail_offset = scanner.tell() - 2
             break
 
         # Check for start of compressed data
-        elif ord3(marker) == SOS:
+        elif marker == SOS:
             logger.debug("jpeg_collect_file_parts: saw start of compressed data")
-            end.append(pack("BB", 0xff, ord3(marker)))
+            tail_offset = scanner.tell() - 2
             break
 
-        partdata = b''
-        partdata = jpeg_skip_variable(fh, partdata)
+        partdata = scanner.read_variable()
         if not partdata:
             raise Exception('jpeg_skip_variable failed')
 
-        partdata = bytes(partdata)
-
         # Take all parts aside from APP13, which we'll replace ourselves.
-        if discard_app_parts and ord3(marker) >= APP0 and ord3(marker) <= 0xef:
+        if discard_app_parts and marker >= APP0 and marker <= 0xef:
             # Skip all application markers, including Adobe parts
             adobeParts = b''
-        elif ord3(marker) == 0xed:
+        elif marker == APP13:
             # Collect the adobe stuff from part 13
             adobeParts = collect_adobe_parts(partdata)
+            tail_offset = scanner.tell()
             break
 
         else:
             # Append all other parts to start section
-            start.append(pack("BB", 0xff, ord3(marker)))
+            start.append(pack("BB", 0xff, marker))
             start.append(pack("!H", len(partdata) + 2))
             start.append(partdata)
 
-    # Append rest of file to end
-    while True:
-        buff = fh.read(8192)
-        if buff is None or len(buff) == 0:
-            break
-
-        end.append(buff)
-
-    return (b''.join(start), b''.join(end), adobeParts)
+    return (b''.join(start), tail_offset, adobeParts)
 
 
 def jpeg_debug_scan(filename):  # pragma: no cover
     """Also very helpful when debugging."""
     assert isinstance(filename, str) and os.path.isfile(filename)
-    with open(filename, 'wb') as fh:
-
-        # Skip past start of file marker
-        (ff, soi) = fh.read(2)
-        if not (ord3(ff) == 0xff and ord3(soi) == SOI):
-            logger.error("jpeg_debug_scan: invalid start of file")
-        else:
-            # scan to 0xDA (start of scan), dumping the markers we see between
-            # here and there.
-            while True:
-                marker = jpeg_next_marker(fh)
-                if ord3(marker) == 0xda:
-                    break
-
-                if ord3(marker) == 0:
-                    logger.warning("Marker scan failed")
-                    break
+    with open(filename, 'rb') as fh:
+        index = jpeg_segment_index(fh)
 
-                elif ord3(marker) == 0xd9:
-                    logger.debug("Marker scan hit end of image marker")
-                    break
+    if index is None:
+        logger.error("jpeg_debug_scan: invalid start of file")
+        return None
 
-                if not jpeg_skip_variable(fh):
-                    logger.warning("jpeg_skip_variable failed")
-                    return None
+    # dump the markers we see between here and start of scan
+    for (marker, offset, length) in index:
+        logger.debug("jpeg_debug_scan: marker %02X at %d, length %d", marker, offset, length)
+    if index.end_marker == EOI:
+        logger.debug("Marker scan hit end of image marker")
+    elif index.end_marker != SOS:
+        logger.warning("Marker scan failed")
+    return index
 
 
 def collect_adobe_parts(data):
@@ -381,26 +1045,28 @@ def collect_adobe_parts(data):
     without losing everything else Photoshop stuffed into the APP13
     block."""
     assert isinstance(data, bytes)
+    view = memoryview(data)
     length = len(data)
-    offset = 0
+    # pieces of the output, joined once at the end; `total` is their length
     out = []
+    total = 0
     # Skip preamble
     offset = len('Photoshop 3.0 ')
     # Process everything
     while offset < length:
         # Get OSType and ID
-        (ostype, id1, id2) = unpack("!LBB", data[offset:offset + 6])
+        (ostype, id1, id2) = unpack_from("!LBB", data, offset)
         offset += 6
         if offset >= length:
             break
 
         # Get pascal string
-        stringlen = unpack("B", data[offset:offset + 1])[0]
+        stringlen = data[offset]
         offset += 1
         if offset >= length:
             break
 
-        string = data[offset:offset + stringlen]
+        string = view[offset:offset + stringlen]
         offset += stringlen
 
         # round up if odd
@@ -413,32 +1079,248 @@ def collect_adobe_parts(data):
             break
 
         # Get variable-size data
-        size = unpack("!L", data[offset:offset + 4])[0]
+        size = unpack_from("!L", data, offset)[0]
         offset += 4
         if offset >= length:
             break
 
-        var = data[offset:offset + size]
+        var = view[offset:offset + size]
+        var_offset = offset
         offset += size
         if size % 2 != 0:
             offset += 1  # round up if odd
 
-        # skip IIM data (0x0404), but write everything else out
+        # skip IIM data (0x0404) and our padding, but write everything else out
+        if ((id1 << 8 | id2) == PADDING_RESOURCE_ID
+                and var[:len(PADDING_SIGNATURE)] == PADDING_SIGNATURE
+                and data.count(b'\x00', var_offset + len(PADDING_SIGNATURE), var_offset + len(var))
+                == len(var) - len(PADDING_SIGNATURE)):
+            continue
         if not (id1 == 4 and id2 == 4):
-            out.append(pack("!LBB", ostype, id1, id2))
-            out.append(pack("B", stringlen))
+            out.append(pack("!LBBB", ostype, id1, id2, stringlen))
             out.append(string)
+            total += 7 + len(string)
             if stringlen == 0 or stringlen % 2 != 0:
-                out.append(pack("B", 0))
+                out.append(b'\x00')
+                total += 1
             out.append(pack("!L", size))
             out.append(var)
-            out = [b''.join(out)]
-            if size % 2 != 0 and len(out[0]) % 2 != 0:
-                out.append(pack("B", 0))
+            total += 4 + len(var)
+            if size % 2 != 0 and total % 2 != 0:
+                out.append(b'\x00')
+                total += 1
 
     return b''.join(out)
 
 
+def photoshop_padding_resource(size):
+    """Returns a Photoshop resource of exactly `size` bytes that is
+    ignored by readers, to reserve room in APP13 for in-place saves.
+    `size` must be even and at least PADDING_MIN_SIZE."""
+    assert size >= PADDING_MIN_SIZE and size % 2 == 0
+    return (b'8BIM' + pack('!HBBL', PADDING_RESOURCE_ID, 0, 0, size - 12) + PADDING_SIGNATURE
+            + b'\x00' * (size - PADDING_MIN_SIZE))
+
+
+# Signatures of Photoshop image resources; 8BIM is the usual one.
+PHOTOSHOP_SIGNATURES = (b'8BIM', b'MeSa', b'AgHg', b'PHUT', b'DCSR')
+
+
+class PhotoshopResourceIndex:
+    """Index of the Photoshop image resources (the "8BIM" blocks) in an
+    APP13 segment or a Photoshop file.
+
+    Keeps the resource id, pascal name, file offset and size of the data
+    of every resource; iterating yields (id, name, offset, size) tuples.
+    The data is only sliced out, as a memoryview of the buffer the index
+    was built from, when asked for with data() or get().
+    """
+    __slots__ = ('ids', 'names', 'offsets', 'sizes', 'base', '_buffer')
+
+    def __init__(self, buffer, base=0):
+        self.ids = array('H')
+        self.names = []
+        self.offsets = array('Q')
+        self.sizes = array('L')
+        self.base = base
+        self._buffer = memoryview(buffer)
+
+    def append(self, resource_id, name, offset, size):
+        self.ids.append(resource_id)
+        self.names.append(name)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return (self.ids[i], self.names[i], self.offsets[i], self.sizes[i])
+
+    def __iter__(self):
+        return zip(self.ids, self.names, self.offsets, self.sizes)
+
+    def __repr__(self):
+        return '<PhotoshopResourceIndex %s>' % ' '.join(
+            '%04X@%d+%d' % (rid, offset, size) for (rid, _, offset, size) in self)
+
+    def find(self, resource_id):
+        """Returns the position of the first resource with this id, or None."""
+        try:
+            return self.ids.index(resource_id)
+        except ValueError:
+            return None
+
+    def data(self, i):
+        """The data of the i-th resource, as a memoryview."""
+        start = self.offsets[i] - self.base
+        return self._buffer[start:start + self.sizes[i]]
+
+    def get(self, resource_id):
+        """The data of the first resource with this id, or None."""
+        i = self.find(resource_id)
+        return None if i is None else self.data(i)
+
+
+def photoshop_resource_index(data, base=0):
+    """Walks the Photoshop image resources in `data`: an APP13 payload
+    (starting with "Photoshop 3.0") or the image resource section of a
+    Photoshop file. `base` is the file offset of `data`, so the offsets in
+    the returned PhotoshopResourceIndex are file offsets.
+
+    Unlike collect_adobe_parts, names are read as specified: the length
+    byte and the name together are padded to an even size. The walk stops
+    at the first block without a known signature; a truncated last
+    resource is cut short.
+    """
+    index = PhotoshopResourceIndex(data, base)
+    view = index._buffer
+    length = len(view)
+    offset = 14 if view[:14] == b'Photoshop 3.0\x00' else 0
+    while offset + 7 <= length and view[offset:offset + 4] in PHOTOSHOP_SIGNATURES:
+        (resource_id, stringlen) = unpack_from('!HB', view, offset + 4)
+        name = view[offset + 7:offset + 7 + stringlen].tobytes()
+        offset += 7 + stringlen + (stringlen + 1) % 2
+        if offset + 4 > length:
+            break
+        size = unpack_from('!L', view, offset)[0]
+        offset += 4
+        index.append(resource_id, name, base + offset, min(size, length - offset))
+        offset += size + size % 2
+    return index
+
+
+# TIFF and Photoshop files
+##########################
+
+TIFF_IPTC_TAG = 33723  # IPTC-NAA: the IIM data
+TIFF_PHOTOSHOP_TAG = 34377  # Photoshop image resources
+
+# bytes per value of the TIFF field types, by type number
+c_tiff_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8,
+                     11: 4, 12: 8, 13: 4, 16: 8, 17: 8, 18: 8}
+
+
+def file_is_tiff(fh):
+    """
+    Checks to see if this file is a TIFF or BigTIFF, in either byte order.
+
+    Will reset the file position back to 0 after it's done in either case.
+    """
+    fh.seek(0)
+    try:
+        return fh.read(4) in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+    finally:
+        fh.seek(0)
+
+
+def tiff_find_tags(fh, tags=(TIFF_IPTC_TAG, TIFF_PHOTOSHOP_TAG), max_ifds=64):
+    """
+    Walks the chain of IFDs of a TIFF or BigTIFF file (not the SubIFDs),
+    up to `max_ifds` of them, and returns {tag: (offset, size)} for the
+    first entry of each of `tags` found: the file offset and size in bytes
+    of its value. Only reads the IFDs.
+
+    Raises EOFException on a truncated or malformed file, including IFDs
+    and values that would reach past its end.
+    """
+    file_size = fh.seek(0, 2)
+    fh.seek(0)
+    header = read_exactly(fh, 16)
+    order = {b'II': '<', b'MM': '>'}.get(header[:2])
+    if order is None:
+        raise EOFException('tiff_find_tags: not a TIFF')
+    (version,) = unpack_from(order + 'H', header, 2)
+    if version == 42:
+        (count_fmt, entry_fmt, next_fmt, value_size) = ('H', 'HHLL', 'L', 4)
+        (ifd,) = unpack_from(order + 'L', header, 4)
+    elif version == 43:
+        (count_fmt, entry_fmt, next_fmt, value_size) = ('Q', 'HHQQ', 'Q', 8)
+        (ifd,) = unpack_from(order + 'Q', header, 8)
+    else:
+        raise EOFException('tiff_find_tags: unknown TIFF version %d' % version)
+    count_size = 2 if count_fmt == 'H' else 8
+    entry_size = 4 + 2 * value_size
+
+    found = {}
+    seen = set()
+    while ifd and ifd not in seen and len(seen) < max_ifds and len(found) < len(tags):
+        seen.add(ifd)
+        fh.seek(ifd)
+        (count,) = unpack(order + count_fmt, read_exactly(fh, count_size))
+        if ifd + count_size + count * entry_size + value_size > file_size:
+            raise EOFException('tiff_find_tags: IFD at %d past the end of the file' % ifd)
+        entries = read_exactly(fh, count * entry_size + value_size)
+        for pos in range(0, count * entry_size, entry_size):
+            (tag, type_, values, value) = unpack_from(order + entry_fmt, entries, pos)
+            if tag not in tags or tag in found:
+                continue
+            size = values * c_tiff_type_sizes.get(type_, 1)
+            # values that fit are stored in the entry itself
+            offset = ifd + count_size + pos + 4 + value_size if size <= value_size else value
+            if offset + size > file_size:
+                raise EOFException('tiff_find_tags: tag %d past the end of the file' % tag)
+            found[tag] = (offset, size)
+        (ifd,) = unpack_from(order + next_fmt, entries, count * entry_size)
+    return found
+
+
+def file_is_psd(fh):
+    """
+    Checks to see if this file is a Photoshop file (PSD, or PSB for the
+    large document format) or not.
+
+    Will reset the file position back to 0 after it's done in either case.
+    """
+    fh.seek(0)
+    try:
+        return fh.read(6) in (b'8BPS\x00\x01', b'8BPS\x00\x02')
+    finally:
+        fh.seek(0)
+
+
+def psd_resource_section(fh):
+    """
+    Returns (offset, length) of the image resource section of a PSD or
+    PSB file, skipping the color mode data by its length.
+
+    Raises EOFException on a truncated file, or if the section would reach
+    past its end.
+    """
+    file_size = fh.seek(0, 2)
+    fh.seek(0)
+    header = read_exactly(fh, 26)
+    if header[:4] != b'8BPS':
+        raise EOFException('psd_resource_section: not a Photoshop file')
+    # both PSD and PSB give these two sections 4 byte lengths
+    (color_mode_length,) = unpack('!L', read_exactly(fh, 4))
+    seek_exactly(fh, color_mode_length)
+    (length,) = unpack('!L', read_exactly(fh, 4))
+    if fh.tell() + length > file_size:
+        raise EOFException('psd_resource_section: resources past the end of the file')
+    return (fh.tell(), length)
+
+
 #####################################
 # These names match the codes defined in ITPC's IIM record 2.
 # This hash is for non-repeating data items; repeating ones
@@ -516,6 +1398,9 @@ c_datasets = {
 
 c_datasets_r = {v: k for k, v in c_datasets.items()}
 
+# The repeatable datasets, read into lists.
+c_listdatasets = (20, 25, 118)
+
 c_charset = {100: 'iso8859_1', 101: 'iso8859_2', 109: 'iso8859_3',
              110: 'iso8859_4', 111: 'iso8859_5', 125: 'iso8859_7',
              127: 'iso8859_6', 138: 'iso8859_8',
@@ -524,15 +1409,113 @@ c_charset_r = {v: k for k, v in c_charset.items()}
 
 
 class UniqueList(list):
-    """A list that prevents duplicate values on append/extend."""
+    """A list that prevents duplicate values on append/extend (and when
+    created from an iterable). Once it holds more than SET_THRESHOLD
+    values, a set of them is kept alongside for O(1) membership checks;
+    shorter lists (most keyword lists) are just scanned, which is as fast
+    and saves the memory of the set. Once the set would hold an unhashable
+    value (e.g. a bytearray, which equals the bytes with the same content)
+    checks fall back to scanning the list."""
+    __slots__ = ('_seen', '_unhashable')
+
+    SET_THRESHOLD = 32
+
+    def __init__(self, values=()):
+        super().__init__()
+        # None while the list is short
+        self._seen = None
+        self._unhashable = False
+        self.extend(values)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def __contains__(self, value):
+        if self._seen is not None:
+            try:
+                if value in self._seen:
+                    return True
+            except TypeError:
+                pass
+            else:
+                if not self._unhashable:
+                    return False
+        return super().__contains__(value)
+
     def append(self, value):
-        if value not in self:
-            super().append(value)
+        if value in self:
+            return
+        super().append(value)
+        if self._seen is not None:
+            try:
+                self._seen.add(value)
+            except TypeError:
+                self._unhashable = True
+        elif len(self) > self.SET_THRESHOLD:
+            self._reseen()
 
     def extend(self, values):
+        values = list(values)
+        if self._seen is None and len(self) + len(values) > self.SET_THRESHOLD:
+            self._reseen(force=True)
+        if self._seen is not None and not self._unhashable:
+            seen = self._seen
+            try:
+                fresh = list(dict.fromkeys(values))
+            except TypeError:
+                pass
+            else:
+                if seen:
+                    fresh = [v for v in fresh if v not in seen]
+                seen.update(fresh)
+                super().extend(fresh)
+                return
         for v in values:
             self.append(v)
 
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    # Other changes may drop any value, so the set is rebuilt after them.
+
+    def _reseen(self, force=False):
+        self._unhashable = False
+        if not force and len(self) <= self.SET_THRESHOLD:
+            self._seen = None
+            return
+        self._seen = set()
+        for v in self:
+            try:
+                self._seen.add(v)
+            except TypeError:
+                self._unhashable = True
+
+    def __setitem__(self, i, value):
+        super().__setitem__(i, value)
+        self._reseen()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self._reseen()
+
+    def insert(self, i, value):
+        super().insert(i, value)
+        self._reseen()
+
+    def pop(self, i=-1):
+        value = super().pop(i)
+        self._reseen()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self._reseen()
+
+    def clear(self):
+        super().clear()
+        self._reseen()
+
 
 class IPTCData(dict):
     """Dict with int/string keys from c_listdatanames"""
@@ -595,6 +1578,9 @@ class IPTCData(dict):
         return str({self._key_as_str(k): v for k, v in self.items()})
 
 
+_NO_PHASE = contextlib.nullcontext()
+
+
 class IPTCInfo:
     """info = IPTCInfo('image filename goes here')
 
@@ -612,11 +1598,22 @@ class IPTCInfo:
     If inp_charset is None, then no translation is done to unicode (except
     when charset is encoded in the image metadata). In this case you should
     be VERY careful to use bytestrings overall with the SAME ENCODING!
+
+    If lazy==True, the file is not opened until the data is first needed
+    (item access, len(), `in` or saving).
+
+    stats can be an IPTCStats, which then collects the time spent in each
+    phase of reading and saving, and the I/O done.
+
+    cache can be an IPTCCache: the data of an unchanged file is then taken
+    from it instead of the file, and saving invalidates the saved file's
+    entry.
     """
 
     error = None
 
-    def __init__(self, fobj, force=False, inp_charset=None, out_charset=None):
+    def __init__(self, fobj, force=False, inp_charset=None, out_charset=None, lazy=False,
+                 stats=None, cache=None):
         self._data = IPTCData({
             'supplemental category': UniqueList(),
             'keywords': UniqueList(),
@@ -632,14 +1629,150 @@ class IPTCInfo:
         self.inp_charset = inp_charset
         self.out_charset = out_charset or inp_charset
 
-        with smart_open(self._fobj, 'rb') as fh:
+        self.stats = stats
+        self.cache = cache
+        # the image, when made with from_bytes
+        self._buffer = None
+        self._parsed = False
+        # _raw() copy of the data in the source file
+        self._saved = None
+        # JpegSegmentIndex built by jpegScan, reused when saving
+        self._segments = None
+        # (file offset, length, data) of the Photoshop resources found while
+        # scanning, for photoshop_resources; see _keep_resources
+        self._app13 = None
+        self._resources = None
+        if not lazy:
+            self._parse()
+
+    def _parse(self, fh=None):
+        """Reads the IPTC data from the file (or from `fh`, which holds the
+        same data), unless that was done already."""
+        if self._parsed:
+            return
+
+        signature = None
+        charset = self.inp_charset
+        if fh is None and self.cache is not None and self._filename is not None:
+            (signature, entry) = self.cache.lookup(self._filename, charset)
+            if entry is not None:
+                self._load_cached(entry)
+                return
+
+        with smart_open(self._source() if fh is None else fh, 'rb') as fh:
+            if self.stats is not None:
+                fh = self.stats.wrap(fh)
             datafound = self.scanToFirstIMMTag(fh)
-            if datafound or force:
+            if datafound or self._force:
                 # Do the real snarfing here
                 if datafound:
-                    self.collectIIMInfo(fh)
+                    with self._phase('collectIIMInfo'):
+                        self.collectIIMInfo(fh)
             else:
-                logger.warning('No IPTC data found in %s', fobj)
+                logger.warning('No IPTC data found in %s', self._fobj)
+        self._parsed = True
+        self._saved = self._raw()
+        if signature is not None:
+            try:
+                self.cache.store(self._filename, self, signature, charset)
+            except sqlite3.Error as e:
+                logger.warning('Could not cache %s: %s', self._filename, e)
+
+    def _load_cached(self, entry):
+        # entries are per inp_charset asked for, so this is the charset a
+        # parse would have ended with (e.g. from the file's charset record)
+        (self.inp_charset, data) = entry
+        for name, value in data.items():
+            self._data[name] = UniqueList(value) if isinstance(value, list) else value
+        self._parsed = True
+        self._saved = self._raw()
+
+    def _raw(self):
+        """A shallow copy of the data, for _snapshot() to encode only when
+        asked what changed: (inp_charset, out_charset, {dataset: value})."""
+        return (self.inp_charset, self.out_charset,
+                {key: tuple(value) if isinstance(value, list) else value
+                 for (key, value) in self._data.items()})
+
+    def _snapshot(self, raw=None):
+        """The data (or the _raw() copy `raw`) as it would be written, to
+        tell what changed: the (charset, {dataset: encoded value}) of the
+        non-empty datasets."""
+        (inp_charset, out_charset, data) = self._raw() if raw is None else raw
+        charset = out_charset or inp_charset
+        # what _enc does, with the charsets of `raw`
+        encoding = charset or 'utf8'
+        out = {}
+        for key, value in data.items():
+            if value is None or (hasattr(value, '__len__') and len(value) == 0):
+                continue
+            try:
+                if isinstance(value, tuple):
+                    out[key] = tuple(v.encode(encoding) if isinstance(v, str) else v
+                                     for v in value)
+                else:
+                    out[key] = value.encode(encoding) if isinstance(value, str) else value
+            except UnicodeError:
+                out[key] = value
+        return (charset, out)
+
+    @property
+    def changed(self):
+        """The names of the datasets that differ from those read from the
+        file (or last saved to it), in dataset order. In-place changes of
+        lists count too."""
+        self._parse()
+        (old, new) = (self._snapshot(self._saved)[1], self._snapshot()[1])
+        return [IPTCData._key_as_str(key) for key in sorted(set(old) | set(new))
+                if old.get(key) != new.get(key)]
+
+    @property
+    def dirty(self):
+        """Whether saving back to the source file would change it: some
+        dataset or the output charset changed."""
+        self._parse()
+        raw = self._raw()
+        return raw != self._saved and self._snapshot(raw) != self._snapshot(self._saved)
+
+    def _needs_saving(self, newfile, options):
+        """Whether save_as(newfile, options) has anything to write."""
+        if (self.dirty or not self._filename or not os.path.exists(newfile)
+                or not os.path.samefile(newfile, self._filename)):
+            return True
+        # these change the file even without new data
+        return options is not None and ('discardAdobeParts' in options or 'padding' in options)
+
+    @classmethod
+    def from_bytes(cls, buf, **kwargs):
+        """Reads the IPTC data of an image held in memory: bytes, a
+        bytearray, a memoryview, an mmap... The buffer isn't copied, but
+        kept as the source for to_bytes() and save_to(), so it must not
+        change in the meantime. Keyword arguments are passed to IPTCInfo."""
+        lazy = kwargs.pop('lazy', False)
+        info = cls(None, lazy=True, **kwargs)
+        info._buffer = buf
+        if not lazy:
+            info._parse()
+        return info
+
+    def _is_jpeg(self):
+        """Whether the source is a Jpeg, the only kind save_as writes."""
+        if self._segments is not None:
+            return True
+        with smart_open(self._source(), 'rb') as fh:
+            return file_is_jpeg(fh)
+
+    def _source(self):
+        """The file name or file object to read the image from."""
+        if self._buffer is not None:
+            return _BufferReader(self._buffer)
+        return self._fobj
+
+    def _phase(self, name):
+        """Context manager timing `name` into self.stats, if any."""
+        if self.stats is None:
+            return _NO_PHASE
+        return self.stats.phase(name)
 
     def _filepos(self, fh):
         """For debugging, return what position in the file we are."""
@@ -653,70 +1786,334 @@ class IPTCInfo:
         return self.save_as(self._filename, options)
 
     def save_as(self, newfile, options=None):
-        """Saves Jpeg with IPTC data to a given file name."""
-        with smart_open(self._fobj, 'rb') as fh:
-            if not file_is_jpeg(fh):
+        """Saves Jpeg with IPTC data to a given file name.
+
+        Options:
+        overwrite: don't keep the old file as a `file~` backup
+        discardAdobeParts: drop the non-IPTC Photoshop resources
+        padding: number of bytes to reserve in APP13, so that later
+          in-place saves have room to grow (needs a dict)
+        inplace: when saving to the source file, only overwrite its APP13
+          segment if the new data fits in it. No backup is made. Falls back
+          to rewriting the whole file if it doesn't fit.
+        atomic: write to a temporary file in the destination's directory
+          and rename it over the destination with os.replace, so there is
+          no cross-device copy and readers see the old or the new file.
+          The file (and then the directory) is fsync'ed before (and after)
+          the rename, so that a crash leaves one or the other too.
+          No backup is made unless asked for with `backup` (needs a dict):
+          True copies the old file to `file~`, 'hardlink' links it there
+          instead, which costs no I/O (and falls back to a copy where
+          links aren't supported).
+
+        Returns True, or None if the source isn't a Jpeg. Saving to the
+        source file when nothing changed (see `dirty`) writes nothing and
+        returns UNCHANGED.
+        """
+        self._parse()
+        if not self._needs_saving(newfile, options):
+            if not self._is_jpeg():
+                logger.error('Source file %s is not a Jpeg.' % self._fobj)
+                return None
+            LOGDBG.info('nothing changed, not saving %s', newfile)
+            if self.stats is not None:
+                self.stats.saves_skipped += 1
+            return UNCHANGED
+
+        if (options is not None and 'inplace' in options and self._filename
+                and os.path.exists(newfile) and os.path.samefile(newfile, self._filename)):
+            with self._phase('inplace'):
+                saved = self._save_inplace(options)
+            if saved:
+                self._saved_to(newfile)
+                return True
+
+        with smart_open(self._source(), 'rb') as fh:
+            if self.stats is not None:
+                fh = self.stats.wrap(fh)
+            header = self._new_header(fh, options)
+            if header is None:
+                return None
+
+            atomic = options is not None and 'atomic' in options
+            LOGDBG.info('writing...')
+            with self._phase('write'):
+                if atomic:
+                    (tmpfd, tmpfn) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(newfile)),
+                                                      prefix='.%s.' % os.path.basename(newfile))
+                else:
+                    (tmpfd, tmpfn) = tempfile.mkstemp()
+                if self._filename and os.path.exists(self._filename):
+                    shutil.copystat(self._filename, tmpfn)
+                tmpfh = os.fdopen(tmpfd, 'wb')
+                if not tmpfh:
+                    logger.error("Can't open output file %r", tmpfn)
+                    return None
+
+                try:
+                    self._write_parts(fh, tmpfh, *header)
+                    if LOGDBG.isEnabledFor(logging.DEBUG):
+                        LOGDBG.debug('pos: %d', self._filepos(tmpfh))
+                    tmpfh.flush()
+                except BaseException:
+                    if atomic:
+                        tmpfh.close()
+                        os.unlink(tmpfn)
+                    raise
+
+        with self._phase('move'):
+            if atomic:
+                try:
+                    # on disk before the rename, so a crash can't leave an
+                    # empty or truncated file under the name
+                    os.fsync(tmpfh.fileno())
+                    tmpfh.close()
+                    backup = options.get('backup') if isinstance(options, dict) else None
+                    if backup and os.path.exists(newfile):
+                        backup_file(newfile, backup == 'hardlink')
+                    os.replace(tmpfn, newfile)
+                except BaseException:
+                    tmpfh.close()
+                    os.unlink(tmpfn)
+                    raise
+                fsync_directory(os.path.dirname(os.path.abspath(newfile)))
+            elif hasattr(tmpfh, 'getvalue'):  # StringIO
+                fh2 = open(newfile, 'wb')
+                fh2.truncate()
+                fh2.seek(0, 0)
+                fh2.write(tmpfh.getvalue())
+                fh2.flush()
+                fh2.close()
+                tmpfh.close()
+                os.unlink(tmpfn)
+            else:
+                tmpfh.close()
+                if os.path.exists(newfile) and options is not None and 'overwrite' in options:
+                    os.unlink(newfile)
+                elif os.path.exists(newfile):
+                    shutil.move(newfile, "{file}~".format(file=newfile))
+                shutil.move(tmpfn, newfile)
+        self._saved_to(newfile)
+        return True
+
+    def _saved_to(self, newfile):
+        if self.stats is not None:
+            self.stats.saves += 1
+        if self.cache is not None:
+            self.cache.invalidate(newfile)
+        if (self._filename and os.path.exists(self._filename)
+                and os.path.samefile(newfile, self._filename)):
+            self._saved = self._raw()
+
+    def save_to(self, fileobj, options=None):
+        """Writes the image with the new IPTC data to `fileobj`, which only
+        needs a write() method (e.g. an open file, a socket file or a
+        BytesIO), without a temporary file. Of the save_as options,
+        discardAdobeParts and padding apply. Returns True, or None if the
+        source isn't a Jpeg."""
+        self._parse()
+        with smart_open(self._source(), 'rb') as fh:
+            if self.stats is not None:
+                fh = self.stats.wrap(fh)
+            header = self._new_header(fh, options)
+            if header is None:
+                return None
+            with self._phase('write'):
+                self._write_parts(fh, fileobj, *header)
+        return True
+
+    def to_bytes(self, options=None):
+        """Returns the image with the new IPTC data as bytes, like
+        save_to. For an IPTCInfo made with from_bytes the output is built
+        with a single copy of the image data."""
+        self._parse()
+        with smart_open(self._source(), 'rb') as fh:
+            if self.stats is not None:
+                fh = self.stats.wrap(fh)
+            header = self._new_header(fh, options)
+            if header is None:
+                return None
+            (parts, tail_offset) = header
+            with self._phase('write'):
+                if self._buffer is not None:
+                    tail = memoryview(self._buffer).cast('B')[tail_offset:]
+                else:
+                    fh.seek(tail_offset)
+                    tail = fh.read()
+                parts.append(tail)
+                out = b''.join(parts)
+                if self.stats is not None:
+                    self.stats.bytes_written += len(out)
+                    self.stats.bytes_copied += len(tail)
+        return out
+
+    def to_header(self, options=None):
+        """Returns (header, tail_offset): what save_as(options) would write
+        in front of the image data, and the offset in the source from which
+        the rest of its output is a verbatim copy of the source. So the new
+        file is header + source[tail_offset:], which can be put together
+        elsewhere, e.g. with a server-side copy of that range, without
+        reading the image data here. Returns None if the source isn't a Jpeg.
+
+        verify_composed() checks such a result."""
+        self._parse()
+        with smart_open(self._source(), 'rb') as fh:
+            if self.stats is not None:
+                fh = self.stats.wrap(fh)
+            header = self._new_header(fh, options)
+        if header is None:
+            return None
+        (parts, tail_offset) = header
+        return (b''.join(parts), tail_offset)
+
+    def verify_composed(self, composed, options=None):
+        """Checks that `composed` (a file name, a binary file object or a
+        bytes-like object) is exactly what save_as(options) would write.
+        Both are streamed through SHA-256, so neither is held in memory."""
+        expected = _HashWriter()
+        if not self.save_to(expected, options):
+            return False
+        actual = _HashWriter()
+        if isinstance(composed, (bytes, bytearray, memoryview)):
+            actual.write(composed)
+        else:
+            with smart_open(composed, 'rb') as fh:
+                for block in iter(functools.partial(fh.read, COPY_CHUNK), b''):
+                    actual.write(block)
+        return (actual.size, actual.digest()) == (expected.size, expected.digest())
+
+    def _new_header(self, fh, options):
+        """Builds the part of the new file in front of the image data,
+        reading the source from `fh`. Returns (list of bytes, offset of
+        the rest of the source, which follows unchanged), or None if the
+        source isn't a Jpeg."""
+        with self._phase('header'):
+            index = self._fresh_segments(fh)
+            if index is None and not file_is_jpeg(fh):
                 logger.error('Source file %s is not a Jpeg.' % self._fobj)
                 return None
 
-            jpeg_parts = jpeg_collect_file_parts(fh)
+            jpeg_parts = jpeg_collect_header_parts(fh, index=index)
 
         if jpeg_parts is None:
-            raise Exception('jpeg_collect_file_parts failed: %s' % self.error)
+            raise Exception('jpeg_collect_header_parts failed: %s' % self.error)
 
-        (start, end, adobe) = jpeg_parts
-        LOGDBG.debug('start: %d, end: %d, adobe: %d', *map(len, jpeg_parts))
-        hex_dump(start)
+        (start, tail_offset, adobe) = jpeg_parts
+        LOGDBG.debug('start: %d, tail offset: %d, adobe: %d', len(start), tail_offset, len(adobe))
         LOGDBG.debug('adobe1: %r', adobe)
         if options is not None and 'discardAdobeParts' in options:
             adobe = None
             LOGDBG.debug('adobe2: %r', adobe)
 
-        LOGDBG.info('writing...')
-        (tmpfd, tmpfn) = tempfile.mkstemp()
-        if self._filename and os.path.exists(self._filename):
-            shutil.copystat(self._filename, tmpfn)
-        tmpfh = os.fdopen(tmpfd, 'wb')
-        if not tmpfh:
-            logger.error("Can't open output file %r", tmpfn)
-            return None
+        with self._phase('packedIIMData'):
+            padding = options.get('padding', 0) if isinstance(options, dict) else 0
+            data = self.photoshopIIMBlock(adobe, self.packedIIMData(), padding=padding)
 
-        LOGDBG.debug('start=%d end=%d', len(start), len(end))
-        LOGDBG.debug('start len=%d dmp=%s', len(start), hex_dump(start))
+        LOGDBG.debug('start len=%d dmp=%s', len(start), HexDump(start))
         # FIXME `start` contains the old IPTC data, so the next we read, we'll get the wrong data
-        tmpfh.write(start)
+        parts = [start]
         # character set
         ch = c_charset_r.get(self.out_charset, None)
         # writing the character set is not the best practice
         # - couldn't find the needed place (record) for it yet!
         if SURELY_WRITE_CHARSET_INFO and ch is not None:
-            tmpfh.write(pack("!BBBHH", 0x1c, 1, 90, 4, ch))
-
-        LOGDBG.debug('pos: %d', self._filepos(tmpfh))
-        data = self.photoshopIIMBlock(adobe, self.packedIIMData())
-        LOGDBG.debug('data len=%d dmp=%s', len(data), hex_dump(data))
-        tmpfh.write(data)
-        LOGDBG.debug('pos: %d', self._filepos(tmpfh))
-        tmpfh.write(end)
-        LOGDBG.debug('pos: %d', self._filepos(tmpfh))
-        tmpfh.flush()
-
-        if hasattr(tmpfh, 'getvalue'):  # StringIO
-            fh2 = open(newfile, 'wb')
-            fh2.truncate()
-            fh2.seek(0, 0)
-            fh2.write(tmpfh.getvalue())
-            fh2.flush()
-            fh2.close()
-            tmpfh.close()
-            os.unlink(tmpfn)
-        else:
-            tmpfh.close()
-            if os.path.exists(newfile) and options is not None and 'overwrite' in options:
-                os.unlink(newfile)
-            elif os.path.exists(newfile):
-                shutil.move(newfile, "{file}~".format(file=newfile))
-            shutil.move(tmpfn, newfile)
+            parts.append(pack("!BBBHH", 0x1c, 1, 90, 4, ch))
+        LOGDBG.debug('data len=%d dmp=%s', len(data), HexDump(data))
+        parts.append(data)
+        return (parts, tail_offset)
+
+    def _write_parts(self, fh, out, parts, tail_offset):
+        """Writes `parts` and the rest of `fh` from `tail_offset` to `out`."""
+        for part in parts:
+            out.write(part)
+        copied = copy_tail(fh, out, tail_offset)
+        if self.stats is not None:
+            self.stats.bytes_written += sum(map(len, parts)) + copied
+            self.stats.bytes_copied += copied
+
+    @property
+    def segments(self):
+        """The JpegSegmentIndex of the source file, or None if it isn't a Jpeg."""
+        self._parse()
+        if self._segments is not None and self._segments.resume is not None:
+            with smart_open(self._source(), 'rb') as fh:
+                index = self._fresh_segments(fh)
+                self._segments = index.finish(fh) if index is not None else jpeg_segment_index(fh)
+        return self._segments
+
+    @property
+    def photoshop_resources(self):
+        """The PhotoshopResourceIndex of the APP13 segment of the source
+        file (or of the Photoshop tag of a TIFF, or the image resource
+        section of a Photoshop file), or None if there is none; e.g.
+        info.photoshop_resources.get(0x040c) is the thumbnail resource.
+
+        Only the location of the resources is kept while scanning a file
+        given by name, so they are read from it again, once, on first
+        access. For in-memory images a view of the buffer is kept, and for
+        file objects the data read while scanning."""
+        self._parse()
+        if self._resources is None and self._app13 is not None:
+            (offset, length, data) = self._app13
+            if data is None:
+                with smart_open(self._source(), 'rb') as fh:
+                    fh.seek(offset)
+                    data = read_exactly(fh, length)
+            self._resources = photoshop_resource_index(data, offset)
+        return self._resources
+
+    def _fresh_segments(self, fh):
+        """Returns the segment index jpegScan built (which may have stopped
+        at APP13), if `fh` is still the same, unchanged file."""
+        index = self._segments
+        if index is None or index.signature is None:
+            return None
+        if index.signature != file_signature(fh):
+            LOGDBG.debug('file changed since it was scanned')
+            return None
+        return index
+
+    def _save_inplace(self, options):
+        """Overwrites just the APP13 segment of the source file, padding the
+        new data to the old segment's size. Returns False (and leaves the
+        file alone) if it doesn't fit."""
+        if SURELY_WRITE_CHARSET_INFO and c_charset_r.get(self.out_charset) is not None:
+            return False
+
+        with open(self._filename, 'r+b') as fh:
+            if self.stats is not None:
+                fh = self.stats.wrap(fh)
+            index = self._fresh_segments(fh)
+            if index is None:
+                if not file_is_jpeg(fh):
+                    return False
+                index = jpeg_segment_index(fh)
+            # a second APP13 can only be ruled out by walking the rest
+            app13 = index.finish(fh).find_all(APP13)
+            if len(app13) != 1:
+                LOGDBG.debug('_save_inplace: no single APP13 segment')
+                return False
+
+            (offset, length) = app13[0]
+            length += 4
+            fh.seek(offset + 4)
+            adobe = collect_adobe_parts(read_exactly(fh, length - 4))
+            if 'discardAdobeParts' in options:
+                adobe = None
+
+            packed = self.packedIIMData()
+            data = self.photoshopIIMBlock(adobe, packed)
+            slack = length - len(data)
+            if slack != 0:
+                if slack < PADDING_MIN_SIZE or slack % 2 != 0:
+                    LOGDBG.debug('_save_inplace: %d bytes do not fit in %d', len(data), length)
+                    return False
+                data = self.photoshopIIMBlock(adobe, packed, padding=slack)
+
+            assert len(data) == length
+            fh.seek(offset)
+            fh.write(data)
+
         return True
 
     def __del__(self):
@@ -725,30 +2122,70 @@ class IPTCInfo:
         pass
 
     def __len__(self):
+        self._parse()
         return len(self._data)
 
     def __contains__(self, key):
+        self._parse()
         return key in self._data
 
     def __getitem__(self, key):
+        self._parse()
         return self._data[key]
 
     def __setitem__(self, key, value):
+        self._parse()
         self._data[key] = value
 
+    def to_dict(self):
+        """Returns the data as a plain dict keyed by dataset name, leaving
+        out empty values. Unlike the IPTCInfo object it is cheap to pickle."""
+        self._parse()
+        out = {}
+        for key, value in self._data.items():
+            if value is None or (hasattr(value, '__len__') and len(value) == 0):
+                continue
+            if isinstance(value, list):
+                value = list(value)
+            out[IPTCData._key_as_str(key)] = value
+        return out
+
     def __str__(self):
+        self._parse()
         return 'charset:\t%s\ndata:\t%s' % (self.inp_charset, self._data)
 
     def scanToFirstIMMTag(self, fh):
         """Scans to first IIM Record 2 tag in the file. The will either
-        use smart scanning for Jpegs or blind scanning for other file
-        types."""
+        use smart scanning for Jpegs, TIFFs and Photoshop files or blind
+        scanning for other file types."""
         if file_is_jpeg(fh):
             logger.info("File is JPEG, proceeding with JpegScan")
-            return self.jpegScan(fh)
+            with self._phase('jpegScan'):
+                return self.jpegScan(fh)
+        elif file_is_tiff(fh):
+            logger.info("File is TIFF, proceeding with TiffScan")
+            with self._phase('tiffScan'):
+                found = self.tiffScan(fh)
+            if found is not None:
+                return found
+            logger.warning("TiffScan: can't read the IFDs, trying blindScan")
+            fh.seek(0)
+            with self._phase('blindScan'):
+                return self.blindScan(fh)
+        elif file_is_psd(fh):
+            logger.info("File is a Photoshop file, proceeding with PsdScan")
+            with self._phase('psdScan'):
+                found = self.psdScan(fh)
+            if found is not None:
+                return found
+            logger.warning("PsdScan: can't read the image resources, trying blindScan")
+            fh.seek(0)
+            with self._phase('blindScan'):
+                return self.blindScan(fh)
         else:
             logger.warning("File not a JPEG, trying blindScan")
-            return self.blindScan(fh)
+            with self._phase('blindScan'):
+                return self.blindScan(fh)
 
     c_marker_err = {0: "Marker scan failed",
                     0xd9: "Marker scan hit EOI (end of image) marker",
@@ -760,117 +2197,211 @@ class IPTCInfo:
         should be found. While this isn't a formally defined standard, all
         programs have (supposedly) adopted Adobe's technique of putting
         the data in APP13."""
-        # Skip past start of file marker
-        try:
-            (ff, soi) = read_exactly(fh, 2)
-        except EOFException:
-            return None
+        # Walk the markers up to the APP13 marker which will contain our
+        # IPTC info (I hope), unless that was done already (by
+        # AsyncIPTCInfo). Saving walks the rest of them if it needs to.
+        (index, scanner) = (self._segments, None)
+        if index is None:
+            try:
+                (index, scanner) = _jpeg_segment_scan(fh, APP13)
+            except EOFException:
+                return None
 
-        if not (ord3(ff) == 0xff and ord3(soi) == SOI):
+        if index is None:
             self.error = "JpegScan: invalid start of file"
             logger.error(self.error)
             return None
 
-        # Scan for the APP13 marker which will contain our IPTC info (I hope).
-        while True:
-            err = None
-            marker = jpeg_next_marker(fh)
-            if ord3(marker) == 0xed:
-                break  # 237
-
-            err = self.c_marker_err.get(ord3(marker), None)
-            if err is None and jpeg_skip_variable(fh) == 0:
-                err = "jpeg_skip_variable failed"
-            if err is not None:
-                self.error = err
-                # When force=True, log as INFO instead of WARNING since we expect no IPTC data
-                if self._force:
-                    logger.info(err)
-                else:
-                    logger.warning(err)
-                return None
+        self._segments = index
+        app13 = index.find(APP13)
+        if app13 is None:
+            # EOF is reported the same way as a failed scan
+            err = self.c_marker_err.get(index.end_marker or 0, None)
+            self.error = err
+            # When force=True, log as INFO instead of WARNING since we expect no IPTC data
+            if self._force:
+                logger.info(err)
+            else:
+                logger.warning(err)
+            return None
 
-        # If were's here, we must have found the right marker.
+        # If were's here, we must have found the right marker. The scanner
+        # is at its data, which it may have read already.
         # Now blindScan through the data.
-        return self.blindScan(fh, MAX=jpeg_get_variable_length(fh))
+        (offset, length) = app13
+        if scanner is not None:
+            window = scanner.read_upto(length + 3)
+        else:
+            fh.seek(offset + 4)
+            window = fh.read(length + 3)
+        if self._filename is None and self._buffer is None:
+            # a file object is closed after reading, walk the rest now
+            index.finish(fh)
+        fh.seek(offset + 4 + len(window))
+        found = self.blindScan(fh, MAX=length, window=window)
+        # after blindScan, which may grow the window
+        self._keep_resources(fh, offset + 4, min(length, len(window)), window)
+        return found
+
+    def tiffScan(self, fh):
+        """Finds the IIM data of a TIFF or BigTIFF file through its IFDs:
+        the IPTC-NAA tag, or else the IIM resource in the Photoshop tag,
+        and seeks to it. Returns False if there is none, and None if the
+        IFDs can't be read."""
+        try:
+            tags = tiff_find_tags(fh)
+        except EOFException as err:
+            logger.debug('TiffScan: %s', err)
+            return None
+
+        if TIFF_IPTC_TAG in tags:
+            if TIFF_PHOTOSHOP_TAG in tags:
+                self._keep_resources(fh, *tags[TIFF_PHOTOSHOP_TAG])
+            return self._scanIIM(fh, *tags[TIFF_IPTC_TAG])
+        elif TIFF_PHOTOSHOP_TAG in tags:
+            return self._scanResources(fh, *tags[TIFF_PHOTOSHOP_TAG])
+        logger.warning('TiffScan: no IPTC tag')
+        return False
 
-    def blindScan(self, fh, MAX=819200):
+    def psdScan(self, fh):
+        """Finds the IIM resource of a Photoshop (PSD or PSB) file in its
+        image resource section, and seeks to the IIM data. Only the header
+        and the resource section are read. Returns False if there is none,
+        and None if the file can't be read."""
+        try:
+            (offset, size) = psd_resource_section(fh)
+        except EOFException as err:
+            logger.debug('PsdScan: %s', err)
+            return None
+        return self._scanResources(fh, offset, size)
+
+    def _keep_resources(self, fh, offset, size, data=None):
+        """Notes where the `size` bytes of Photoshop resources at `offset`
+        are, for photoshop_resources. A file given by name is read again
+        when they are needed. Of an in-memory image a view of them is kept.
+        A file object is closed after reading, so their data is kept: the
+        `data` they start, or else what is read from `fh`."""
+        if self._filename is not None:
+            data = None
+        elif self._buffer is not None:
+            data = memoryview(self._buffer).cast('B')[offset:offset + size]
+        elif data is None:
+            fh.seek(offset)
+            data = fh.read(size)
+        else:
+            data = memoryview(data)[:size]
+        self._app13 = (offset, size if data is None else len(data), data)
+
+    def _scanResources(self, fh, offset, size):
+        """Seeks to the IIM data of the Photoshop image resources at
+        `offset` in the file."""
+        fh.seek(offset)
+        data = fh.read(size)
+        self._keep_resources(fh, offset, len(data), data)
+        resources = photoshop_resource_index(data, offset)
+        i = resources.find(IIM_RESOURCE_ID)
+        if i is None:
+            logger.warning('No IIM resource in the Photoshop image resources')
+            return False
+        return self._scanIIM(fh, resources.offsets[i], resources.sizes[i])
+
+    def _scanIIM(self, fh, offset, size):
+        """Seeks to the first IIM Record 2 tag of the `size` bytes of IIM
+        data at `offset` in the file, reading the character set on the
+        way, and returns the file position, or False if there is none."""
+        fh.seek(offset)
+        found = self.blindScan(fh, MAX=size, window=fh.read(size + 3))
+        # blindScan reports the offset in the data, which can be 0
+        return fh.tell() if found is not None and found is not False else found
+
+    def blindScan(self, fh, MAX=819200, window=None):
         """Scans blindly to first IIM Record 2 tag in the file. This
         method may or may not work on any arbitrary file type, but it
         doesn't hurt to check. We expect to see this tag within the first
         8k of data. (This limit may need to be changed or eliminated
-        depending on how other programs choose to store IIM.)"""
+        depending on how other programs choose to store IIM.)
+
+        `window` is the first MAX + 3 bytes, if the caller read them from
+        `fh` already."""
 
-        offset = 0
         # keep within first 819200 bytes
         # NOTE: this may need to change
         logger.debug('blindScan: starting scan, max length %d', MAX)
 
-        # start digging
-        while offset <= MAX:
-            try:
-                temp = read_exactly(fh, 1)
-            except EOFException:
-                logger.warning("BlindScan: hit EOF while scanning")
-                return None
-            # look for tag identifier 0x1c
-            if ord3(temp) == 0x1c:
-                # if we found that, look for record 2, dataset 0
-                # (record version number)
-                (record, dataset) = fh.read(2)
-                if record == 1 and dataset == 90:
-                    # found character set's record!
-                    try:
-                        temp = read_exactly(fh, jpeg_get_variable_length(fh))
-                        cs = None
-                        # Check for ISO 2022 escape sequence (starts with ESC 0x1b)
-                        if len(temp) >= 3 and ord3(temp[0]) == 0x1b:
-                            # Parse ISO 2022 escape sequences
-                            # ESC % G = UTF-8
-                            if temp == b'\x1b%G':
-                                self.inp_charset = 'utf_8'
-                            # ESC % / @ = UTF-16 (not commonly used)
-                            elif temp == b'\x1b%/@':
-                                self.inp_charset = 'utf_16'
-                            else:
-                                logger.debug(
-                                    "BlindScan: unknown ISO 2022 charset escape sequence %r",
-                                    temp)
-                        else:
-                            # Try legacy numeric charset encoding
-                            try:
-                                cs = unpack('!H', temp)[0]
-                                if cs in c_charset:
-                                    self.inp_charset = c_charset[cs]
-                            except Exception:
-                                logger.debug('BlindScan: could not parse charset from %r', temp)
-
-                        if self.inp_charset:
-                            logger.info("BlindScan: found character set '%s' at offset %d",
-                                        self.inp_charset, offset)
-                    except EOFException:
-                        pass
-
-                elif record == 2:
-                    # found it. seek to start of this tag and return.
-                    logger.debug("BlindScan: found IIM start at offset %d", offset)
-                    try:  # seek rel to current position
-                        seek_exactly(fh, -3)
-                    except EOFException:
-                        return None
-                    return offset
+        # Read the whole window at once and jump between candidate tags
+        # with bytes.find. `offset` counts scanned positions the same way
+        # the byte-at-a-time scan did: the bytes of a character set record
+        # are consumed without advancing it, so it lags behind the byte
+        # position `pos` by `skew`.
+        if window is None:
+            start = fh.tell()
+            window = fh.read(MAX + 3)
+        else:
+            start = fh.tell() - len(window)
+        pos = skew = 0
+        next_iim = next_charset = -1
+        while True:
+            if next_iim < pos:
+                next_iim = window.find(b'\x1c\x02', pos)
+            if next_charset < pos:
+                next_charset = window.find(b'\x1c\x01Z', pos)
+            candidates = [i for i in (next_iim, next_charset) if i >= 0]
+            if not candidates:
+                break
+            pos = min(candidates)
+            offset = pos - skew
+            if offset > MAX:
+                break
+
+            if pos == next_iim:
+                # found it. seek to start of this tag and return.
+                logger.debug("BlindScan: found IIM start at offset %d", offset)
+                fh.seek(start + pos)
+                return offset
+
+            # found character set's record!
+            window += fh.read(max(0, pos + 5 - len(window)))
+            length = unpack('!H', window[pos + 3:pos + 5])[0] if pos + 5 <= len(window) else 0
+            length = length - 2 if length >= 2 else 0
+            # the record is skipped without advancing `offset`, so keep
+            # enough bytes buffered to still cover MAX offsets
+            skew += 4 + length
+            window += fh.read(max(0, max(pos + 5 + length, MAX + skew + 3) - len(window)))
+            temp = window[pos + 5:pos + 5 + length]
+            pos += 5 + length
+            if len(temp) < length:
+                continue
 
+            cs = None
+            # Check for ISO 2022 escape sequence (starts with ESC 0x1b)
+            if len(temp) >= 3 and ord3(temp[0]) == 0x1b:
+                # Parse ISO 2022 escape sequences
+                # ESC % G = UTF-8
+                if temp == b'\x1b%G':
+                    self.inp_charset = 'utf_8'
+                # ESC % / @ = UTF-16 (not commonly used)
+                elif temp == b'\x1b%/@':
+                    self.inp_charset = 'utf_16'
                 else:
-                    # didn't find it. back up 2 to make up for
-                    # those reads above.
-                    try:  # seek rel to current position
-                        seek_exactly(fh, -2)
-                    except EOFException:
-                        return None
-
-            # no tag, keep scanning
-            offset += 1
+                    logger.debug(
+                        "BlindScan: unknown ISO 2022 charset escape sequence %r",
+                        temp)
+            else:
+                # Try legacy numeric charset encoding
+                try:
+                    cs = unpack('!H', temp)[0]
+                    if cs in c_charset:
+                        self.inp_charset = c_charset[cs]
+                except Exception:
+                    logger.debug('BlindScan: could not parse charset from %r', temp)
 
+            if self.inp_charset:
+                logger.info("BlindScan: found character set '%s' at offset %d",
+                            self.inp_charset, offset)
+
+        if pos - skew <= MAX and len(window) < MAX + skew + 1:
+            logger.warning("BlindScan: hit EOF while scanning")
+            return None
         return False
 
     def collectIIMInfo(self, fh):
@@ -889,8 +2420,8 @@ class IPTCInfo:
             if not (tag == 0x1c and record == 2):
                 return None
 
-            alist = {'tag': tag, 'record': record, 'dataset': dataset, 'length': length}
-            logger.debug('\t'.join('%s: %s' % (k, v) for k, v in alist.items()))
+            logger.debug('tag: %s\trecord: %s\tdataset: %s\tlength: %s',
+                         tag, record, dataset, length)
             value = fh.read(length)
 
             if self.inp_charset:
@@ -932,13 +2463,14 @@ class IPTCInfo:
     def packedIIMData(self):
         """Assembles and returns our _data and _listdata into IIM format for
         embedding into an image."""
+        self._parse()
         out = []
         (tag, record) = (0x1c, 0x02)
         # Print record version
         # tag - record - dataset - len (short) - 4 (short)
         out.append(pack("!BBBHH", tag, record, 0, 2, 4))
 
-        LOGDBG.debug('out=%s', hex_dump(out))
+        LOGDBG.debug('out=%s', HexDump(out))
         # Iterate over data sets
         for dataset, value in self._data.items():
             # Skip None, empty strings, empty lists, and NaN values
@@ -959,27 +2491,36 @@ class IPTCInfo:
                 logger.warning("packedIIMData: illegal dataname '%s' (%d)", dataset, dataset)
                 continue
 
-            logger.debug('packedIIMData %02X: %r -> %r', dataset, value, self._enc(value))
-            value = self._enc(value)
+            encoded = self._enc(value)
+            logger.debug('packedIIMData %02X: %r -> %r', dataset, value, encoded)
+            value = encoded
             if not isinstance(value, list):
                 value = bytes(value)
                 out.append(pack("!BBBH", tag, record, dataset, len(value)))
                 out.append(value)
             else:
-                seen = set()
+                # a UniqueList (as _enc returns for one) has no duplicates
+                seen = None if isinstance(value, UniqueList) else set()
                 for v in map(bytes, value):
-                    if v is None or len(v) == 0 or v in seen:
+                    if len(v) == 0:
                         continue
-                    seen.add(v)
+                    if seen is not None:
+                        if v in seen:
+                            continue
+                        seen.add(v)
                     out.append(pack("!BBBH", tag, record, dataset, len(v)))
                     out.append(v)
 
         return b''.join(out)
 
-    def photoshopIIMBlock(self, otherparts, data):
+    def photoshopIIMBlock(self, otherparts, data, padding=0):
         """Assembles the blob of Photoshop "resource data" that includes our
         fresh IIM data (from PackedIIMData) and the other Adobe parts we
-        found in the file, if there were any."""
+        found in the file, if there were any.
+
+        If padding is given, a padding resource of that many bytes (rounded
+        up to even, at least PADDING_MIN_SIZE) is added at the end, as long as the
+        segment stays within the 64k limit."""
         out = []
         assert isinstance(data, bytes)
         resourceBlock = [b"Photoshop 3.0"]
@@ -998,6 +2539,11 @@ class IPTCInfo:
         # Finally tack on other data
         if otherparts is not None:
             resourceBlock.append(otherparts)
+        if padding:
+            padding = min(max(PADDING_MIN_SIZE, padding + padding % 2),
+                          0xffff - 2 - sum(map(len, resourceBlock)))
+            if padding >= PADDING_MIN_SIZE:
+                resourceBlock.append(photoshop_padding_resource(padding - padding % 2))
         resourceBlock = b''.join(resourceBlock)
 
         out.append(pack("BB", 0xff, 0xed))  # Jpeg start of block, APP13
@@ -1007,17 +2553,944 @@ class IPTCInfo:
         return b''.join(out)
 
 
+# Metadata cache
+################
+
+class IPTCCache:
+    """
+    A persistent cache of parsed IPTC data, in an sqlite database.
+
+        cache = IPTCCache('iptc-cache.sqlite', max_entries=1000000)
+        info = IPTCInfo('photo.jpg', cache=cache)
+
+    Entries are keyed on the absolute path and the inp_charset the file
+    was read with, and checked against the file's (st_size, st_mtime_ns,
+    st_ino) with a single os.stat(), so reading an unchanged file costs a
+    stat and a database lookup instead of a parse. IPTCInfo objects filled
+    from the cache have no `segments` or `photoshop_resources`. Saving
+    through an IPTCInfo with this cache invalidates the saved file's
+    entries.
+
+    When there are more than `max_entries` entries, or they take more than
+    `max_bytes`, the least recently used ones are dropped. The cache can be
+    shared by threads, and by processes: pickling reopens the database.
+    """
+
+    SCHEMA_VERSION = 2
+    # entries / bytes dropped at once beyond the limit, to evict in batches
+    EVICT_SLACK = 0.05
+
+    def __init__(self, filename, max_entries=None, max_bytes=None):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        with self._db:
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS entries')
+                self._db.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries (path TEXT, charset TEXT, '
+                             'size INTEGER, mtime_ns INTEGER, ino INTEGER, data BLOB, '
+                             'used INTEGER, PRIMARY KEY (path, charset))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+        if filename != ':memory:':
+            self._db.execute('PRAGMA journal_mode = WAL')
+        (self._used, self._count, self._bytes) = self._db.execute(
+            'SELECT coalesce(max(used), 0), count(*), coalesce(sum(length(data)), 0) '
+            'FROM entries').fetchone()
+        # (path, charset) -> use counter of hits not written to the database yet
+        self._touched = {}
+
+    def __reduce__(self):
+        return (_reopen_cache, (self.__class__, self.filename, self.max_entries, self.max_bytes))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM entries').fetchone()[0]
+
+    def lookup(self, path, charset=None):
+        """Returns (signature, entry) for the file at `path` read with
+        inp_charset `charset`. `entry` is the cached (inp_charset, data) if
+        the file is unchanged, else None; `signature` is None if the file
+        can't be stat'ed."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return (None, None)
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        key = (os.path.abspath(path), charset or '')
+        with self._lock:
+            row = self._db.execute('SELECT size, mtime_ns, ino, data FROM entries '
+                                   'WHERE path = ? AND charset = ?', key).fetchone()
+            if row is None or tuple(row[:3]) != signature:
+                return (signature, None)
+            self._used += 1
+            self._touched[key] = self._used
+            if len(self._touched) >= 1000:
+                self._flush()
+        try:
+            return (signature, marshal.loads(row[3]))
+        except (EOFError, ValueError, TypeError):
+            return (signature, None)
+
+    def get(self, path, **kwargs):
+        """IPTCInfo(path, **kwargs).to_dict(), from the cache if the file
+        is unchanged."""
+        return IPTCInfo(path, cache=self, **kwargs).to_dict()
+
+    def store(self, path, info, signature, charset=None):
+        """Stores what `info` read from `path` with inp_charset `charset`;
+        the file's signature was `signature` before reading it."""
+        data = marshal.dumps((info.inp_charset, info.to_dict()))
+        key = (os.path.abspath(path), charset or '')
+        with self._lock:
+            self._used += 1
+            self._touched.pop(key, None)
+            with self._db:
+                old = self._db.execute('SELECT length(data) FROM entries '
+                                       'WHERE path = ? AND charset = ?', key).fetchone()
+                self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 key + tuple(signature) + (data, self._used))
+            (self._count, self._bytes) = (self._count + (old is None),
+                                          self._bytes + len(data) - (old[0] if old else 0))
+            if ((self.max_entries is not None and self._count > self.max_entries)
+                    or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._evict()
+
+    def invalidate(self, path):
+        """Drops the entries of `path`, if any."""
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [key for key in self._touched if key[0] == path]:
+                del self._touched[key]
+            with self._db:
+                (count, size) = self._db.execute(
+                    'SELECT count(*), coalesce(sum(length(data)), 0) FROM entries '
+                    'WHERE path = ?', (path,)).fetchone()
+                self._db.execute('DELETE FROM entries WHERE path = ?', (path,))
+            (self._count, self._bytes) = (self._count - count, self._bytes - size)
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            with self._db:
+                self._db.execute('DELETE FROM entries')
+            self._count = self._bytes = 0
+
+    def _flush(self):
+        # records the hits, for the LRU order
+        with self._db:
+            self._db.executemany('UPDATE entries SET used = ? WHERE path = ? AND charset = ?',
+                                 [(used,) + key for (key, used) in self._touched.items()])
+        self._touched.clear()
+
+    def _evict(self):
+        self._flush()
+        (count, size) = self._db.execute(
+            'SELECT count(*), coalesce(sum(length(data)), 0) FROM entries').fetchone()
+        keep = 1 - self.EVICT_SLACK
+        max_entries = count if self.max_entries is None else int(self.max_entries * keep)
+        max_bytes = size if self.max_bytes is None else int(self.max_bytes * keep)
+        drop = []
+        for (path, charset, length) in self._db.execute(
+                'SELECT path, charset, length(data) FROM entries ORDER BY used'):
+            if count <= max_entries and size <= max_bytes:
+                break
+            drop.append((path, charset))
+            count -= 1
+            size -= length
+        with self._db:
+            self._db.executemany('DELETE FROM entries WHERE path = ? AND charset = ?', drop)
+        (self._count, self._bytes) = (count, size)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# caches unpickled in this process, so that every chunk sent to a worker
+# process doesn't open the database again
+_open_caches = {}
+
+
+def _reopen_cache(cls, filename, max_entries, max_bytes):
+    key = (cls, filename, max_entries, max_bytes)
+    if key not in _open_caches:
+        _open_caches[key] = cls(filename, max_entries, max_bytes)
+    return _open_caches[key]
+
+
+# Bulk operations
+#################
+
+c_executors = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _map_chunks(pool, func, chunks, max_pending, ordered, key, *args):
+    """Runs func(chunk, *args) on the pool for every chunk, keeping at most
+    `max_pending` of them in flight, and yields the items of the lists it
+    returns. If a whole chunk fails (e.g. its results can't be pickled),
+    yields (key(item), error) for every item in it."""
+    pending = {}
+    order = deque()
+    chunks = iter(chunks)
+    try:
+        while True:
+            for chunk in itertools.islice(chunks, max_pending - len(pending)):
+                future = pool.submit(func, chunk, *args)
+                pending[future] = chunk
+                if ordered:
+                    order.append(future)
+            if not pending:
+                return
+
+            if ordered:
+                done = [order.popleft()]
+            else:
+                done = wait(pending, return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                chunk = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as err:
+                    results = [(key(item), err) for item in chunk]
+                yield from results
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _read_chunk(paths, kwargs):
+    results = []
+    for path in paths:
+        try:
+            results.append((path, IPTCInfo(path, **kwargs).to_dict()))
+        except Exception as err:
+            results.append((path, err))
+    return results
+
+
+def read_many(paths, workers=None, backend='thread', chunksize=1, ordered=True, **kwargs):
+    """
+    Reads the IPTC data of many files on a pool of `workers` threads
+    (backend='thread') or processes (backend='process').
+
+    Yields (path, result) for every path, where result is what
+    IPTCInfo.to_dict() returns, or the exception that reading the file
+    raised. Other keyword arguments are passed to IPTCInfo.
+
+    Paths are sent to the workers `chunksize` at a time, and only a couple
+    of chunks per worker are in flight, so `paths` can be a lazy iterable
+    of any length. With ordered=False results come back as soon as they
+    are ready instead of in the order of `paths`.
+    """
+    if backend not in c_executors:
+        raise ValueError('backend must be one of %s' % ', '.join(c_executors))
+    workers = workers or os.cpu_count() or 1
+
+    with c_executors[backend](max_workers=workers) as pool:
+        yield from _map_chunks(pool, _read_chunk, _chunked(paths, chunksize),
+                               2 * workers, ordered, lambda path: path, kwargs)
+
+
+def _write_one(path, changes, options, kwargs):
+    """Applies `changes` to the file and atomically replaces it."""
+    info = IPTCInfo(path, **kwargs)
+    for key, value in changes.items():
+        info[key] = value
+    return info.save_as(path, dict(options or {}, atomic=True))
+
+
+def _write_chunk(edits, options, kwargs):
+    results = []
+    for (path, changes) in edits:
+        try:
+            results.append((path, _write_one(path, changes, options, kwargs)))
+        except Exception as err:
+            results.append((path, err))
+    return results
+
+
+def _coalesced(edits):
+    merged = {}
+    for (path, changes) in edits:
+        merged.setdefault(path, {}).update(changes)
+    return merged.items()
+
+
+def write_many(edits, changes=None, workers=None, backend='thread', chunksize=1,
+               ordered=True, options=None, coalesce=True, counts=None, **kwargs):
+    """
+    Changes the IPTC data of many files on a pool of workers, like
+    read_many does for reading.
+
+    `edits` is an iterable of (path, changes) pairs, where changes is a
+    dict of dataset name -> new value; or, if `changes` is given, an
+    iterable of paths that all get the same changes.
+
+    Every file is committed atomically (the 'atomic' option of save_as):
+    it is saved to a temporary file in the same directory, which then
+    replaces it, so readers see either the old or the new file and no
+    backup is left behind unless `options` ask for one. `options` are
+    passed to save_as, other keyword arguments to IPTCInfo (force defaults
+    to True, so files without IPTC data get some).
+
+    Files that already hold the changes are not written, and get UNCHANGED
+    as result. All the edits are collected first and those of the same
+    file merged (later values win), so that each file is written at most
+    once and a file is never written by two workers at a time. With
+    coalesce=False the edits stream through instead, for iterables too
+    large to hold; then every path must come up only once, or concurrent
+    writes of the same file lose all but one of its edits.
+
+    Yields (path, result) for every file, where result is what save_as
+    returned or the exception that was raised. If `counts` is given (a
+    dict, e.g. a collections.Counter), its 'written', 'unchanged' and
+    'failed' entries are incremented as results come in.
+    """
+    if backend not in c_executors:
+        raise ValueError('backend must be one of %s' % ', '.join(c_executors))
+    workers = workers or os.cpu_count() or 1
+    if changes is not None:
+        edits = ((path, changes) for path in edits)
+    if coalesce:
+        edits = _coalesced(edits)
+    if isinstance(options, (list, tuple, set, frozenset)):
+        # save_as takes a list of option names too, _write_one adds one
+        options = dict.fromkeys(options, True)
+    kwargs.setdefault('force', True)
+
+    with c_executors[backend](max_workers=workers) as pool:
+        for (path, result) in _map_chunks(pool, _write_chunk, _chunked(edits, chunksize),
+                                          2 * workers, ordered, lambda edit: edit[0],
+                                          options, kwargs):
+            if counts is not None:
+                outcome = ('unchanged' if result == UNCHANGED else
+                           'written' if result is True else 'failed')
+                counts[outcome] = counts.get(outcome, 0) + 1
+            yield (path, result)
+
+
+def _text_bytes(value):
+    # values of files with a charset record (or read with inp_charset) are str
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+class BinaryColumn:
+    """
+    A column of bytes values (or None), stored like Arrow's large_binary:
+    value i is data[offsets[i]:offsets[i + 1]] and valid[i] is 0 for None.
+    """
+
+    __slots__ = ('offsets', 'data', 'valid')
+
+    def __init__(self):
+        self.offsets = array('Q', [0])
+        self.data = bytearray()
+        self.valid = bytearray()
+
+    def append(self, value):
+        if value is None:
+            self.valid.append(0)
+        else:
+            self.data += _text_bytes(value)
+            self.valid.append(1)
+        self.offsets.append(len(self.data))
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __getitem__(self, i):
+        if not self.valid[i]:
+            return None
+        if i < 0:
+            i += len(self)
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self):
+        data = memoryview(self.data)
+        for i, valid in enumerate(self.valid):
+            yield bytes(data[self.offsets[i]:self.offsets[i + 1]]) if valid else None
+
+    def to_arrow(self):
+        import pyarrow as pa
+        validity = None
+        if 0 in self.valid:
+            validity = bytearray((len(self) + 7) // 8)
+            for i, valid in enumerate(self.valid):
+                if valid:
+                    validity[i >> 3] |= 1 << (i & 7)
+            validity = pa.py_buffer(bytes(validity))
+        return pa.Array.from_buffers(pa.large_binary(), len(self), [
+            validity, pa.py_buffer(self.offsets.tobytes()), pa.py_buffer(bytes(self.data))])
+
+
+class BinaryListColumn:
+    """
+    A column of lists of bytes, stored like Arrow's large_list: row i holds
+    items[offsets[i]:offsets[i + 1]], all items being in one BinaryColumn.
+    """
+
+    __slots__ = ('offsets', 'items')
+
+    def __init__(self):
+        self.offsets = array('Q', [0])
+        self.items = BinaryColumn()
+
+    def append(self, values):
+        for value in values or ():
+            self.items.append(value)
+        self.offsets.append(len(self.items))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return [self.items[j] for j in range(self.offsets[i], self.offsets[i + 1])]
+
+    def __iter__(self):
+        items = iter(self.items)
+        for i in range(len(self)):
+            yield list(itertools.islice(items, self.offsets[i + 1] - self.offsets[i]))
+
+    def to_arrow(self):
+        import pyarrow as pa
+        offsets = pa.Array.from_buffers(pa.int64(), len(self.offsets),
+                                        [None, pa.py_buffer(self.offsets.tobytes())])
+        return pa.LargeListArray.from_arrays(offsets, self.items.to_arrow())
+
+
+class IPTCColumns:
+    """
+    IPTC data of many files, one column per dataset, as read_columns
+    returns it. Far smaller than a list of IPTCInfo objects or dicts: each
+    column keeps its values in a single buffer.
+
+    `path` is a list of the file names, and columns['keywords'] (or
+    table['keywords']) a BinaryColumn or, for repeatable datasets, a
+    BinaryListColumn, both sequences of bytes values. Text read as str
+    (files with a charset record, or read with inp_charset) is stored as
+    UTF-8. Files that could not be read are not rows, but are listed in
+    `errors` as (path, exception).
+
+    The columns only use the array module; to_arrow() and to_pandas() need
+    pyarrow and pandas. The object can be pickled.
+    """
+
+    __slots__ = ('fields', 'path', 'columns', 'errors')
+
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = c_datasets.values()
+        self.fields = [IPTCData._key_as_str(IPTCData._key_as_int(name)) for name in fields]
+        self.path = []
+        self.columns = {
+            name: (BinaryListColumn() if IPTCData._key_as_int(name) in c_listdatasets
+                   else BinaryColumn())
+            for name in self.fields}
+        self.errors = []
+
+    def append(self, path, data):
+        """Adds a row; `data` is a dict like IPTCInfo.to_dict() returns."""
+        self.path.append(path)
+        for name, column in self.columns.items():
+            column.append(data.get(name))
+
+    def __len__(self):
+        return len(self.path)
+
+    def __getitem__(self, name):
+        if name == 'path':
+            return self.path
+        return self.columns[name]
+
+    def row(self, i):
+        """Row `i` as a dict, without the empty fields like to_dict()."""
+        out = {'path': self.path[i]}
+        for name, column in self.columns.items():
+            value = column[i]
+            if value:
+                out[name] = value
+        return out
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def take(self, indices):
+        """A new IPTCColumns with just the given rows."""
+        out = IPTCColumns(self.fields)
+        for i in indices:
+            out.append(self.path[i], {name: column[i] for name, column in self.columns.items()})
+        return out
+
+    def filter(self, mask):
+        """A new IPTCColumns with the rows where `mask` (an iterable of
+        booleans, e.g. a generator over a column) is true."""
+        return self.take([i for i, keep in enumerate(mask) if keep])
+
+    def to_pydict(self, encoding=None):
+        """Returns {'path': [...], field: [...]}, decoding the values with
+        `encoding` if given."""
+        out = {'path': list(self.path)}
+        for name, column in self.columns.items():
+            values = list(column)
+            if encoding is not None:
+                values = [
+                    [v.decode(encoding, 'replace') for v in value] if isinstance(value, list)
+                    else value.decode(encoding, 'replace') if value is not None else None
+                    for value in values]
+            out[name] = values
+        return out
+
+    def to_arrow(self):
+        """The columns as a pyarrow.Table, without copying them value by value."""
+        import pyarrow as pa
+        names = ['path'] + self.fields
+        arrays = [pa.array([os.fsdecode(path) for path in self.path], pa.string())]
+        arrays.extend(self.columns[name].to_arrow() for name in self.fields)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def to_pandas(self, encoding=None):
+        import pandas
+        return pandas.DataFrame(self.to_pydict(encoding), columns=['path'] + self.fields)
+
+
+def read_columns(paths, fields=None, workers=None, backend='thread', chunksize=1, **kwargs):
+    """
+    Reads many files like read_many, but collects the results into an
+    IPTCColumns with a column for each of `fields` (dataset names, default
+    all) instead of yielding a dict per file. Rows are in the order of
+    `paths`; files that fail are listed in its `errors`.
+    """
+    table = IPTCColumns(fields)
+    for path, result in read_many(paths, workers=workers, backend=backend,
+                                  chunksize=chunksize, **kwargs):
+        if isinstance(result, Exception):
+            table.errors.append((path, result))
+        else:
+            table.append(path, result)
+    return table
+
+
+# Search index
+##############
+
+class IPTCIndex:
+    """
+    An inverted index of dataset values over directory trees, in an
+    sqlite database, to find files by their IPTC data without opening
+    them.
+
+        index = IPTCIndex('photos.index')
+        index.update(['photos/'], workers=8)
+        index.search(all=[('keywords', 'cat'), ('by-line', 'Jane Doe')])
+        index.search(any=[('city', 'Paris'), ('city', 'Lyon')])
+
+    Values of `fields` are indexed whole, and those of `TOKENIZED` fields
+    word by word; matching ignores case. update() only parses files whose
+    (st_size, st_mtime_ns, st_ino) changed since the last update and drops
+    the files that are gone.
+    """
+
+    SCHEMA_VERSION = 1
+    FIELDS = ('keywords', 'by-line', 'city', 'headline')
+    TOKENIZED = ('headline',)
+    # files looked up in the database at once by update()
+    BATCH = 1000
+
+    def __init__(self, filename, fields=FIELDS, encoding='utf-8'):
+        self.filename = filename
+        self.fields = [IPTCData._key_as_str(IPTCData._key_as_int(field)) for field in fields]
+        self.encoding = encoding
+        self._db = sqlite3.connect(filename, timeout=30)
+        with self._db:
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS files')
+                self._db.execute('DROP TABLE IF EXISTS terms')
+                self._db.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+            self._db.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, '
+                             'path TEXT UNIQUE, size INTEGER, mtime_ns INTEGER, ino INTEGER, '
+                             'seen INTEGER)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS terms (field TEXT, term TEXT, '
+                             'file INTEGER, PRIMARY KEY (field, term, file)) WITHOUT ROWID')
+            self._db.execute('CREATE INDEX IF NOT EXISTS terms_file ON terms (file)')
+        if filename != ':memory:':
+            self._db.execute('PRAGMA journal_mode = WAL')
+
+    def __len__(self):
+        return self._db.execute('SELECT count(*) FROM files').fetchone()[0]
+
+    def _terms(self, field, value):
+        if isinstance(value, bytes):
+            value = value.decode(self.encoding, 'replace')
+        value = str(value).casefold()
+        if field in self.TOKENIZED:
+            return re.findall(r'\w+', value)
+        value = value.strip()
+        return [value] if value else []
+
+    def update(self, paths, workers=None, backend='thread', chunksize=16, **kwargs):
+        """
+        Brings the index up to date with the files among `paths`, walked
+        like iter_files(paths). Files that are new or changed are read with
+        read_many (other keyword arguments are passed to it), and files
+        that were indexed under one of the directories in `paths` but are
+        gone are dropped.
+
+        Returns the counts of 'added', 'updated', 'removed', 'unchanged'
+        and 'errors' files.
+        """
+        # walked, then looked at again to drop the files that are gone
+        paths = list(paths)
+        counts = dict.fromkeys(('added', 'updated', 'removed', 'unchanged', 'errors'), 0)
+        generation = self._db.execute('SELECT coalesce(max(seen), 0) + 1 FROM files').fetchone()[0]
+        signatures = {}
+
+        def changed():
+            # yields the files to read, and marks the unchanged ones as seen
+            for batch in _chunked(iter_files(paths), self.BATCH):
+                stats = {}
+                for path in batch:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    stats[os.path.abspath(path)] = (st.st_size, st.st_mtime_ns, st.st_ino)
+                known = {}
+                for names in _chunked(stats, 500):
+                    known.update((row[0], row[1:]) for row in self._db.execute(
+                        'SELECT path, size, mtime_ns, ino, id FROM files WHERE path IN (%s)'
+                        % ','.join('?' * len(names)), names))
+                unchanged = []
+                for path, signature in stats.items():
+                    if path in signatures:
+                        continue
+                    row = known.get(path)
+                    if row is not None and tuple(row[:3]) == signature:
+                        unchanged.append((generation, row[3]))
+                    else:
+                        signatures[path] = (signature, row and row[3])
+                        yield path
+                with self._db:
+                    self._db.executemany('UPDATE files SET seen = ? WHERE id = ?', unchanged)
+                counts['unchanged'] += len(unchanged)
+
+        for path, result in read_many(changed(), workers=workers, backend=backend,
+                                      chunksize=chunksize, ordered=False, **kwargs):
+            (signature, file_id) = signatures.pop(path)
+            if isinstance(result, Exception):
+                # kept without terms, so that it isn't read again until it changes
+                logger.warning('IPTCIndex: %s: %s', path, result)
+                counts['errors'] += 1
+                result = {}
+            with self._db:
+                if file_id is None:
+                    file_id = self._db.execute(
+                        'INSERT INTO files (path, size, mtime_ns, ino, seen) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (path,) + signature + (generation,)).lastrowid
+                    counts['added'] += 1
+                else:
+                    self._db.execute('UPDATE files SET size = ?, mtime_ns = ?, ino = ?, seen = ? '
+                                     'WHERE id = ?', signature + (generation, file_id))
+                    self._db.execute('DELETE FROM terms WHERE file = ?', (file_id,))
+                    counts['updated'] += 1
+                terms = set()
+                for field in self.fields:
+                    values = result.get(field)
+                    for value in values if isinstance(values, list) else [values] if values else []:
+                        terms.update((field, term, file_id) for term in self._terms(field, value))
+                self._db.executemany('INSERT INTO terms VALUES (?, ?, ?)', terms)
+
+        with self._db:
+            for path in paths:
+                path = os.path.abspath(path)
+                if os.path.isdir(path):
+                    # every path below the directory: '0' follows os.sep ('/' or '\\') in ASCII
+                    prefix = path.rstrip(os.sep)
+                    where = ('seen < ? AND path > ? AND path < ?',
+                             (generation, prefix + os.sep, prefix + chr(ord(os.sep) + 1)))
+                else:
+                    where = ('seen < ? AND path = ?', (generation, path))
+                self._db.execute('DELETE FROM terms WHERE file IN (SELECT id FROM files WHERE %s)'
+                                 % where[0], where[1])
+                counts['removed'] += self._db.execute('DELETE FROM files WHERE %s' % where[0],
+                                                      where[1]).rowcount
+        return counts
+
+    def _select(self, field, value):
+        field = IPTCData._key_as_str(IPTCData._key_as_int(field))
+        if field not in self.fields:
+            raise ValueError('%r is not indexed' % field)
+        terms = self._terms(field, value)
+        if not terms:
+            raise ValueError('nothing to search in %r' % (value,))
+        query = 'SELECT file FROM terms WHERE field = ? AND term = ?'
+        return (' INTERSECT '.join([query] * len(terms)),
+                [param for term in terms for param in (field, term)])
+
+    def search(self, all=(), any=()):
+        """
+        Returns the paths of the files that have every (field, value) of
+        `all` and at least one of `any`, sorted. A value of a tokenized
+        field (e.g. headline) matches files that have all of its words.
+        """
+        groups = []
+        params = []
+        for (terms, op) in ((all, ' INTERSECT '), (any, ' UNION ')):
+            selects = [self._select(field, value) for (field, value) in terms]
+            if selects:
+                groups.append('SELECT file FROM (%s)' % op.join(
+                    'SELECT file FROM (%s)' % sql for (sql, _) in selects))
+                params.extend(param for (_, p) in selects for param in p)
+        if not groups:
+            raise ValueError('nothing to search')
+        query = 'SELECT path FROM files WHERE id IN (%s) ORDER BY path' % ' INTERSECT '.join(groups)
+        return [row[0] for row in self._db.execute(query, params)]
+
+    def values(self, field):
+        """Returns {term: number of files} for an indexed field."""
+        field = IPTCData._key_as_str(IPTCData._key_as_int(field))
+        return dict(self._db.execute(
+            'SELECT term, count(*) FROM terms WHERE field = ? GROUP BY term', (field,)))
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# asyncio
+#########
+
+def _read_jpeg_header(path):
+    """Reads a Jpeg file up to the data of its APP13 segment (and the 3
+    bytes blindScan looks ahead), or else up to the image data. Returns
+    (header, JpegSegmentIndex), or (None, None) if neither can be found."""
+    with open(path, 'rb') as fh:
+        if not file_is_jpeg(fh):
+            return (None, None)
+        index = jpeg_segment_index(fh, until=APP13)
+        if index is None:
+            return (None, None)
+        fh.seek(0)
+        if index.resume is not None:
+            return (fh.read(index.resume + 3), index)
+        if index.end is not None:
+            return (read_exactly(fh, index.end + 2), index)
+        return (None, None)
+
+
+class AsyncIPTCInfo:
+    """
+    Reads and saves IPTC data from asyncio code without blocking the
+    event loop.
+
+    File I/O runs on a thread pool (an internal one unless `executor` is
+    given), with at most `limit` operations in flight; further calls wait
+    for a free slot, so e.g. one instance per storage volume bounds the
+    load on it. Jpeg headers are read on the pool but parsed on the loop.
+
+        async with AsyncIPTCInfo(limit=32) as iptc:
+            info = await iptc.read('photo.jpg')
+            info['headline'] = 'Hi'
+            await iptc.save(info)
+    """
+
+    def __init__(self, limit=16, executor=None):
+        self._limit = limit
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=limit)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shuts down the internal thread pool."""
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args, **kwargs):
+        # created here, so that it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limit)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs))
+
+    async def read(self, path, **kwargs):
+        """Returns the IPTCInfo of the file at `path`, which is read here
+        (`lazy` is ignored). Other keyword arguments are passed to
+        IPTCInfo. With a `cache`, all of the reading runs on the pool,
+        since looking up the cache is I/O too."""
+        kwargs.pop('lazy', None)
+        header = None
+        if kwargs.get('cache') is None:
+            (header, index) = await self._run(_read_jpeg_header, path)
+        if header is None:
+            return await self._run(IPTCInfo, path, **kwargs)
+
+        info = IPTCInfo(path, lazy=True, **kwargs)
+        # the header has the same offsets as the file, so jpegScan uses the
+        # index of the file instead of walking the header again
+        info._segments = index
+        info._parse(io.BytesIO(header))
+        return info
+
+    async def save(self, info, options=None):
+        """info.save(options) on the thread pool."""
+        return await self._run(info.save, options)
+
+    async def save_as(self, info, newfile, options=None):
+        """info.save_as(newfile, options) on the thread pool."""
+        return await self._run(info.save_as, newfile, options)
+
+
+# Command line
+##############
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.tif', '.tiff', '.psd', '.psb')
+
+
+def iter_files(paths, extensions=IMAGE_EXTENSIONS, changed_since=None):
+    """
+    Yields the files among `paths`, walking directories recursively with
+    os.scandir. Files found in directories must have one of `extensions`
+    (None for any), and with `changed_since` (a timestamp) a modification
+    time no older than it. Files named directly are always yielded.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = sorted(it, key=lambda entry: entry.name, reverse=True)
+            except OSError as err:
+                logger.warning('iter_files: %s', err)
+                continue
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif not entry.is_file():
+                    continue
+                elif extensions is not None and not entry.name.lower().endswith(extensions):
+                    continue
+                elif changed_since is None or entry.stat().st_mtime >= changed_since:
+                    yield entry.path
+
+
+def _jsonable(value, encoding):
+    if isinstance(value, bytes):
+        return value.decode(encoding, 'replace')
+    elif isinstance(value, list):
+        return [_jsonable(v, encoding) for v in value]
+    return value
+
+
+def _timestamp(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main(argv=None):
+    """The iptcinfo3 command: prints the IPTC data of files and directory
+    trees as one JSON object per line, or as CSV."""
+    parser = argparse.ArgumentParser(prog='iptcinfo3', description=main.__doc__)
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='files or directories to read')
+    parser.add_argument('-f', '--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--fields', type=lambda text: [f.strip() for f in text.split(',')],
+                        help='comma separated datasets to output (default: all)')
+    parser.add_argument('--changed-since', type=_timestamp, metavar='TIME',
+                        help='only files in directories modified since TIME (epoch or ISO 8601)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--backend', choices=sorted(c_executors), default='thread')
+    parser.add_argument('--encoding', default='utf-8', help='for values without a charset')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='cache the data of unchanged files in FILE (sqlite)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log warnings too')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.ERROR)
+    fields = args.fields
+    for field in fields or ():
+        try:
+            IPTCData._key_as_int(field)  # fail early on typos
+        except KeyError:
+            parser.error("unknown dataset '%s' in --fields" % field)
+    if args.format == 'csv':
+        columns = fields or [c_datasets[k] for k in sorted(c_datasets)]
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['path', 'error'] + columns)
+
+    files = errors = 0
+    began = time.perf_counter()
+    paths = iter_files(args.paths, changed_since=args.changed_since)
+    cache = IPTCCache(args.cache) if args.cache else None
+    kwargs = {} if cache is None else {'cache': cache}
+    for path, result in read_many(paths, workers=args.workers, backend=args.backend,
+                                  chunksize=16, ordered=False, **kwargs):
+        files += 1
+        if isinstance(result, Exception):
+            errors += 1
+            (error, result) = ('%s: %s' % (type(result).__name__, result), {})
+        else:
+            error = None
+            result = {k: _jsonable(v, args.encoding) for k, v in result.items()}
+        if fields is not None:
+            data = IPTCData({k: v for k, v in result.items()})
+            result = {field: data[field] for field in fields if field in data}
+
+        if args.format == 'csv':
+            writer.writerow([path, error or ''] + [
+                ';'.join(value) if isinstance(value, list) else value
+                for value in map(result.get, columns)])
+        else:
+            record = {'path': path, 'iptc': result}
+            if error is not None:
+                record['error'] = error
+            print(json.dumps(record, ensure_ascii=False))
+
+    if cache is not None:
+        cache.close()
+    elapsed = time.perf_counter() - began
+    print('%d files, %d errors in %.2fs (%.0f files/s)'
+          % (files, errors, elapsed, files / elapsed if elapsed else 0), file=sys.stderr)
+    return 1 if errors else 0
+
+
 if __name__ == '__main__':  # pragma: no cover
-    logging.basicConfig(level=logging.ERROR)
-    if len(sys.argv) > 1:
-        info = IPTCInfo(sys.argv[1])
-        if info.__dict__ != '':
-            for k, v in info.__dict__.items():
-                if k == '_data':
-                    print(k)
-                    for key, value in v.items():
-                        if type(value) == list:
-                            print(key, [x.decode() for x in value])
-                            [print(x.decode()) for x in value]
-                        print(key, value)
-                print(k, v)
+    sys.exit(main())
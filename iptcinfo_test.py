@@ -1,18 +1,54 @@
+import asyncio
+import io
+import json
+import pickle
 import random
+import shutil
+import sqlite3
+import struct
 import os
 
 import pytest
 
+import iptcinfo3
 from iptcinfo3 import (
+    AsyncIPTCInfo,
     EOFException,
+    IPTCCache,
     IPTCData,
+    IPTCIndex,
     IPTCInfo,
+    IPTCStats,
+    UNCHANGED,
+    JpegScanner,
+    UniqueList,
+    collect_adobe_parts,
+    copy_tail,
     file_is_jpeg,
     hex_dump,
     jpeg_collect_file_parts,
+    jpeg_collect_header_parts,
+    jpeg_next_marker,
+    jpeg_segment_index,
+    jpeg_skip_variable,
+    main,
+    ord3,
+    photoshop_padding_resource,
+    psd_resource_section,
+    read_columns,
+    read_many,
+    tiff_find_tags,
+    write_many,
 )
 
 
+def _copy_fixture(name, path):
+    """Copies fixtures/`name` to `path`, for tests that change the file.
+    Returns the path as a str."""
+    shutil.copy(os.path.join('fixtures', name), str(path))
+    return str(path)
+
+
 def test_EOFException_message():
     exp = EOFException()
     assert str(exp) == ''
@@ -42,6 +78,174 @@ def test_jpeg_collect_parts_works_with_many_jpegs():
     assert len(adobe) == 0
 
 
+def test_jpeg_collect_header_parts_points_at_end():
+    for fn in ('fixtures/Lenna.jpg', 'fixtures/instagram.jpg'):
+        with open(fn, 'rb') as fh:
+            start, end, adobe = jpeg_collect_file_parts(fh)
+            assert jpeg_collect_header_parts(fh) == (start, os.path.getsize(fn) - len(end), adobe)
+
+
+def test_copy_tail_copies_between_files_and_file_likes(tmp_path):
+    data = bytes(range(256)) * 1000
+    src = tmp_path / 'src'
+    src.write_bytes(data)
+
+    with open(src, 'rb') as fh, open(tmp_path / 'dst', 'wb') as out:
+        out.write(b'head')
+        assert copy_tail(fh, out, 1000) == len(data) - 1000
+        out.write(b'foot')
+    assert (tmp_path / 'dst').read_bytes() == b'head' + data[1000:] + b'foot'
+
+    out = io.BytesIO()
+    assert copy_tail(io.BytesIO(data), out, 5) == len(data) - 5
+    assert out.getvalue() == data[5:]
+
+
+def _legacy_markers(fh):
+    fh.read(2)
+    markers = []
+    while True:
+        marker = jpeg_next_marker(fh)
+        if marker is None:
+            return markers
+        markers.append(ord3(marker))
+        if ord3(marker) == 0xda:
+            return markers
+        jpeg_skip_variable(fh)
+
+
+def _scanner_markers(fh, chunk_size):
+    scanner = JpegScanner(fh, chunk_size=chunk_size)
+    scanner.read(2)
+    markers = []
+    while True:
+        marker = scanner.next_marker()
+        if marker is None:
+            return markers
+        markers.append(marker)
+        if marker == 0xda:
+            return markers
+        scanner.skip_variable()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096, 65536])
+def test_jpeg_scanner_finds_same_markers_as_jpeg_next_marker(chunk_size):
+    with open('fixtures/instagram.jpg', 'rb') as fh:
+        data = fh.read()
+    # pad every marker after SOI with a run of 0xff fill bytes
+    sos = data.index(b'\xff\xda')
+    padded = data[:2] + data[2:sos].replace(b'\xff', b'\xff' * 5) + data[sos:]
+
+    for blob in (data, padded):
+        expected = _legacy_markers(io.BytesIO(blob))
+        assert expected[-1] == 0xda
+        assert _scanner_markers(io.BytesIO(blob), chunk_size) == expected
+
+    assert (_scanner_markers(io.BytesIO(data[:100]), chunk_size)
+            == _legacy_markers(io.BytesIO(data[:100])))
+
+
+def test_jpeg_scanner_grows_its_reads():
+    sizes = []
+
+    class Reads(io.BytesIO):
+        def read(self, size=-1):
+            sizes.append(size)
+            return super().read(size)
+
+    # a header of a few bytes takes a single small read
+    fh = Reads(b'\xff\xd8\xff\xe0\x00\x04ab\xff\xda' + b'\x00' * 100000)
+    assert _scanner_markers(fh, 16) == [0xe0, 0xda]
+    assert sizes == [16]
+
+    # reads double while the data isn't there yet
+    del sizes[:]
+    fh = Reads(b'\xff\xd8' + b'\xff' * 1000 + b'\xe0\x00\x04ab\xff\xda')
+    scanner = JpegScanner(fh, chunk_size=16, max_chunk_size=256)
+    scanner.read(2)
+    assert scanner.next_marker() == 0xe0
+    assert sizes == [16, 32, 64, 128, 256, 256, 256]
+
+
+@pytest.mark.parametrize('reader', [io.BytesIO, iptcinfo3._BufferReader])
+def test_jpeg_scanner_read_upto(reader):
+    data = bytes(range(256)) * 100
+    scanner = JpegScanner(reader(data), chunk_size=16)
+    assert scanner.read(10) == data[:10]
+    assert scanner.read_upto(5000) == data[10:5010]
+    assert scanner.tell() == 5010
+    assert scanner.read(3) == data[5010:5013]
+    assert scanner.read_upto(10 ** 6) == data[5013:]
+    assert scanner.read_upto(1) == b''
+
+
+def test_jpeg_scan_reads_app13_once(tmp_path):
+    fn = str(tmp_path / 'padded.jpg')
+    IPTCInfo('fixtures/instagram.jpg').save_as(fn, {'padding': 60000})
+    stats = IPTCStats()
+    info = IPTCInfo(fn, stats=stats)
+    (offset, length) = info._segments.find(0xed)
+    assert length > 60000
+    assert stats.bytes_read < offset + length + 4096
+    assert info['keywords'] == IPTCInfo('fixtures/instagram.jpg')['keywords']
+
+
+def test_jpeg_segment_index_lists_segments_up_to_image_data():
+    with open('fixtures/instagram.jpg', 'rb') as fh:
+        index = jpeg_segment_index(fh)
+        fh.seek(0)
+        assert [marker for (marker, offset, length) in index] == _legacy_markers(fh)[:-1]
+        assert index.end_marker == 0xda
+
+        (offset, length) = index.find(0xed)
+        assert (0xed, offset, length) in list(index)
+        assert index.read(fh, 1).startswith(b'Photoshop 3.0')
+        fh.seek(offset)
+        assert fh.read(4) == b'\xff\xed' + (length + 2).to_bytes(2, 'big')
+
+        fh.seek(index.end)
+        assert fh.read(2) == b'\xff\xda'
+
+        partial = jpeg_segment_index(fh, until=0xed)
+        assert list(partial) == list(index)[:2]
+        assert (partial.end, partial.resume) == (None, offset + 4 + length)
+        assert (jpeg_collect_header_parts(fh, True, index=partial)
+                == jpeg_collect_header_parts(fh, True))
+        assert list(partial) == list(index)
+        assert (partial.end, partial.end_marker, partial.resume) == (index.end, 0xda, None)
+
+    with open('setup.cfg', 'rb') as fh:
+        assert jpeg_segment_index(fh) is None
+
+    assert IPTCInfo('fixtures/instagram.jpg').segments.find(0xe2) is not None
+    with open('fixtures/instagram.jpg', 'rb') as fh:
+        assert IPTCInfo(fh).segments.find(0xe2) is not None
+
+
+@pytest.mark.parametrize('threshold', [0, 3, UniqueList.SET_THRESHOLD])
+def test_unique_list_keeps_order_and_skips_duplicates(monkeypatch, threshold):
+    # with and without the set, and crossing over to it
+    monkeypatch.setattr(UniqueList, 'SET_THRESHOLD', threshold)
+    values = UniqueList([b'a', b'b', b'a'])
+    values.append(b'b')
+    values.extend([b'c', b'a', b'c'])
+    values += [b'd']
+    assert values == [b'a', b'b', b'c', b'd']
+    assert isinstance(values, list)
+
+    values.remove(b'a')
+    assert b'a' not in values
+    values.append(b'a')
+    values[0] = bytearray(b'x')
+    values.extend([b'x', b'b'])
+    assert values == [b'x', b'c', b'd', b'a', b'b']
+
+    copy = pickle.loads(pickle.dumps(values))
+    assert type(copy) is UniqueList and copy == values
+    copy.append(b'c')
+    assert copy == values
+
+
 def test_IPTCData():
     data = IPTCData({105: 'Audiobook Narrator Really Going For Broke With Cajun Accent'})
     assert data['headline'].startswith('Audiobook')
@@ -93,6 +297,126 @@ def test_getitem_can_read_info():
     assert 'keywords' in info
     assert 'nonexistent' not in info
 
+
+def test_blind_scan_finds_charset_and_iim_start():
+    data = b'\x1c' * 1000 + b'\x1c\x01Z\x00\x04\x00\xc4' + b'\x1c\x02\x05\x00\x06h\xc3\xa9llo'
+
+    info = IPTCInfo(io.BytesIO(data))
+    assert info.inp_charset == 'utf_8'
+    assert info['object name'] == 'h\xe9llo'
+
+    fh = io.BytesIO(data)
+    # the charset record is skipped over without counting its bytes
+    assert info.blindScan(fh) == 1001
+    assert fh.tell() == 1007
+    assert not info.blindScan(io.BytesIO(data), MAX=1000)
+
+
+def _tiff(iim, byteorder='<', bigtiff=False, photoshop=False, resources=b''):
+    # noise with IIM look-alikes, then the IIM data (and, with `resources`,
+    # a Photoshop tag next to the IPTC one) and the IFD
+    image = b'\x1c\x02\x00' * 1000
+    if photoshop:
+        iim = b'8BIM\x04\x04\x00\x00' + struct.pack('>L', len(iim)) + iim
+    if bigtiff:
+        (head, count, entry, next_ifd) = (16, 'Q', 'HHQQ', 'Q')
+    else:
+        (head, count, entry, next_ifd) = (8, 'H', 'HHLL', 'L')
+    ifd = head + len(image) + len(iim) + len(resources)
+    if bigtiff:
+        header = struct.pack(byteorder + 'HHHQ', 43, 8, 0, ifd)
+    else:
+        header = struct.pack(byteorder + 'HL', 42, ifd)
+    entries = [(256, 3, 1, 1000), (34377 if photoshop else 33723, 7, len(iim), head + len(image))]
+    if resources:
+        entries.append((34377, 7, len(resources), head + len(image) + len(iim)))
+    return ((b'II' if byteorder == '<' else b'MM') + header + image + iim + resources
+            + struct.pack(byteorder + count, len(entries))
+            + b''.join(struct.pack(byteorder + entry, *e) for e in entries)
+            + struct.pack(byteorder + next_ifd, 0))
+
+
+@pytest.mark.parametrize('layout', [{}, {'byteorder': '>'}, {'bigtiff': True},
+                                    {'bigtiff': True, 'byteorder': '>', 'photoshop': True}])
+def test_tiff_scan_reads_iptc_tag(layout):
+    iim = b'\x1c\x01Z\x00\x04\x00\xc4\x1c\x02\x19\x00\x03cat\x1c\x02\x19\x00\x04\xc3\xa9t\xc3'
+    info = IPTCInfo(io.BytesIO(_tiff(iim, **layout)))
+    assert info.inp_charset == 'utf_8'
+    assert info['keywords'] == ['cat', 'ét\ufffd']
+    tag = 34377 if layout.get('photoshop') else 33723
+    assert set(tiff_find_tags(io.BytesIO(_tiff(iim, **layout)))) == {tag}
+
+
+def test_tiff_photoshop_resources_next_to_iptc_tag(tmp_path):
+    thumbnail = b'8BIM\x04\x0c\x00\x00' + struct.pack('>L', 4) + b'jpeg'
+    data = _tiff(b'\x1c\x02\x19\x00\x03cat', resources=thumbnail)
+    fn = tmp_path / 'both.tif'
+    fn.write_bytes(data)
+    for info in (IPTCInfo(str(fn)), IPTCInfo(io.BytesIO(data)), IPTCInfo.from_bytes(data)):
+        assert info['keywords'] == [b'cat']
+        assert bytes(info.photoshop_resources.get(0x040c)) == b'jpeg'
+    # an in-memory image isn't copied
+    assert info._app13[2].obj is data
+
+
+def test_tiff_scan_falls_back_to_blind_scan_on_broken_ifds():
+    # the IFD offset points past the end of the file
+    data = b'II*\x00' + struct.pack('<L', 1 << 20) + b'\x1c\x02\x05\x00\x04name'
+    assert IPTCInfo(io.BytesIO(data))['object name'] == b'name'
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_psd_scan_reads_iim_resource(version):
+    iim = b'\x1c\x02\x19\x00\x03cat\x1c\x02\x19\x00\x03dog'
+    resources = (b'8BIM\x04\x0c\x00\x00' + struct.pack('>L', 6) + b'\x1c\x02\x05\x00\x01x'
+                 + b'8BIM\x04\x04\x03abc' + struct.pack('>L', len(iim)) + iim)
+    data = (b'8BPS' + struct.pack('>H6xHLLHH', version, 3, 10, 10, 8, 3)
+            + struct.pack('>L', 768) + b'\x1c\x02' * 384
+            + struct.pack('>L', len(resources)) + resources + b'\x1c\x02' * 1000)
+    info = IPTCInfo(io.BytesIO(data))
+    assert info['keywords'] == [b'cat', b'dog']
+    assert info['object name'] is None
+    assert ([(rid, name) for (rid, name, _, _) in info.photoshop_resources]
+            == [(0x040c, b''), (0x0404, b'abc')])
+
+
+@pytest.mark.parametrize('ifd', [
+    # an entry count of 2**40
+    struct.pack('<Q', 1 << 40),
+    # an IPTC tag of 2**50 bytes
+    struct.pack('<QHHQQQ', 1, 33723, 1, 1 << 50, 100, 0),
+])
+def test_tiff_scan_rejects_sizes_past_end_of_file(tmp_path, ifd):
+    data = b'II+\x00\x08\x00\x00\x00' + struct.pack('<Q', 16) + ifd
+    with pytest.raises(EOFException):
+        tiff_find_tags(io.BytesIO(data))
+    fn = str(tmp_path / 'hostile.tif')
+    with open(fn, 'wb') as out:
+        out.write(data)
+    for source in (io.BytesIO(data), fn):
+        info = IPTCInfo(source, force=True)
+        assert info.to_dict() == {}
+
+
+def test_psd_scan_rejects_resource_section_past_end_of_file():
+    data = (b'8BPS' + struct.pack('>H6xHLLHH', 1, 3, 10, 10, 8, 3)
+            + struct.pack('>LL', 0, 0xffffffff) + b'8BIM')
+    with pytest.raises(EOFException):
+        psd_resource_section(io.BytesIO(data))
+    assert IPTCInfo(io.BytesIO(data), force=True).to_dict() == {}
+
+
+def test_lazy_info_reads_file_on_first_access():
+    info = IPTCInfo('fixtures/nonexistent.jpg', lazy=True)
+    with pytest.raises(FileNotFoundError):
+        len(info)
+
+    info = IPTCInfo('fixtures/Lenna.jpg', lazy=True)
+    assert info._data == {20: [], 25: [], 118: []}
+    assert 'keywords' in info
+    assert info._data == IPTCInfo('fixtures/Lenna.jpg')._data
+
+
 def test_save_as_saves_as_new_file_with_info():
     if os.path.isfile('fixtures/deleteme.jpg'):  # pragma: no cover
         os.unlink('fixtures/deleteme.jpg')
@@ -126,3 +450,607 @@ def test_save_as_saves_as_new_file_with_new_info():
     info2 = IPTCInfo('fixtures/deleteme.jpg')
 
     assert info2['headline'] == new_headline
+
+
+def test_from_bytes_and_to_bytes_match_save_as(tmp_path):
+    with open('fixtures/Lenna.jpg', 'rb') as fh:
+        raw = fh.read()
+    fn = str(tmp_path / 'saved.jpg')
+    info = IPTCInfo('fixtures/Lenna.jpg')
+    info['headline'] = b'in memory'
+    info.save_as(fn)
+    with open(fn, 'rb') as fh:
+        saved = fh.read()
+
+    assert info.to_bytes() == saved
+    for buf in (raw, bytearray(raw), memoryview(raw)):
+        info = IPTCInfo.from_bytes(buf)
+        assert info['keywords'] == [b'lenna', b'test']
+        info['headline'] = b'in memory'
+        assert info.to_bytes() == saved
+        out = io.BytesIO()
+        assert info.save_to(out)
+        assert out.getvalue() == saved
+
+    assert IPTCInfo.from_bytes(b'not a jpeg', force=True).to_bytes() is None
+
+
+def test_to_header_composes_with_source_tail(tmp_path):
+    info = IPTCInfo('fixtures/instagram.jpg')
+    info['headline'] = b'composed'
+    (header, tail_offset) = info.to_header()
+    with open('fixtures/instagram.jpg', 'rb') as fh:
+        fh.seek(tail_offset)
+        composed = header + fh.read()
+
+    assert info.verify_composed(composed)
+    assert not info.verify_composed(composed[:-1])
+    fn = tmp_path / 'composed.jpg'
+    fn.write_bytes(composed)
+    assert info.verify_composed(str(fn))
+    info.save_as(str(tmp_path / 'saved.jpg'))
+    assert (tmp_path / 'saved.jpg').read_bytes() == composed
+
+
+def test_save_skips_files_without_changes(tmp_path):
+    fn = _copy_fixture('Lenna.jpg', tmp_path / 'src.jpg')
+    stats = IPTCStats()
+    info = IPTCInfo(fn, stats=stats)
+    os.utime(fn, ns=(0, 0))
+
+    info['keywords'] = list(info['keywords'])
+    info['headline'] = info['headline'].decode()
+    assert not info.dirty and info.changed == []
+    assert info.save() == UNCHANGED
+    assert os.stat(fn).st_mtime_ns == 0 and not os.path.exists(fn + '~')
+
+    info['keywords'].append(b'new')
+    info['city'] = b'Somewhere'
+    assert info.changed == ['keywords', 'city']
+    assert info.save_as(str(tmp_path / 'copy.jpg')) is True
+    assert info.dirty
+    assert info.save({'overwrite': True}) is True
+    assert not info.dirty
+    assert info.save() == UNCHANGED
+    assert (stats.saves, stats.saves_skipped) == (2, 2)
+    assert IPTCInfo(fn)['keywords'] == [b'lenna', b'test', b'new']
+
+
+def test_reads_dont_encode_the_saved_data(monkeypatch):
+    def no_snapshot(self, raw=None):
+        raise AssertionError('data encoded while reading')
+
+    monkeypatch.setattr(IPTCInfo, '_snapshot', no_snapshot)
+    info = IPTCInfo('fixtures/Lenna.jpg')
+    info['keywords'].append(b'new')
+    info['keywords'].remove(b'new')
+    assert not info.dirty
+
+
+def test_save_of_unchanged_non_jpeg_fails(tmp_path):
+    fn = str(tmp_path / 'src.tif')
+    with open(fn, 'wb') as fh:
+        fh.write(_tiff(b'\x1c\x02\x19\x00\x03cat'))
+    info = IPTCInfo(fn)
+    assert not info.dirty
+    assert info.save() is None
+    info['keywords'] = [b'dog']
+    assert info.save() is None
+
+
+@pytest.mark.parametrize('backup', [None, True, 'hardlink'])
+def test_save_atomic_replaces_file_in_its_directory(tmp_path, monkeypatch, backup):
+    fn = _copy_fixture('Lenna.jpg', tmp_path / 'src.jpg')
+    with open(fn + '~', 'wb') as out:
+        out.write(b'older backup')
+    inode = os.stat(fn).st_ino
+    temp_dirs = []
+    mkstemp = iptcinfo3.tempfile.mkstemp
+
+    def recording_mkstemp(*args, **kwargs):
+        temp_dirs.append(kwargs.get('dir'))
+        return mkstemp(*args, **kwargs)
+
+    monkeypatch.setattr(iptcinfo3.tempfile, 'mkstemp', recording_mkstemp)
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.append(fd) or fsync(fd))
+    info = IPTCInfo(fn)
+    info['headline'] = b'atomic'
+    assert info.save({'atomic': True, 'backup': backup}) is True
+
+    assert temp_dirs == [str(tmp_path)]
+    # the new file, then the directory after the rename
+    assert len(synced) == 2
+    assert IPTCInfo(fn)['headline'] == b'atomic'
+    assert os.stat(fn).st_ino != inode
+    assert sorted(os.listdir(tmp_path)) == ['src.jpg', 'src.jpg~']
+    with open(fn + '~', 'rb') as fh:
+        backed_up = fh.read()
+    if backup:
+        with open('fixtures/Lenna.jpg', 'rb') as fh:
+            assert backed_up == fh.read()
+        assert (os.stat(fn + '~').st_ino == inode) == (backup == 'hardlink')
+    else:
+        assert backed_up == b'older backup'
+
+
+def _legacy_adobe_parts(data):
+    # collect_adobe_parts before it used a memoryview: the reference output
+    length = len(data)
+    out = []
+    offset = len('Photoshop 3.0 ')
+    while offset < length:
+        (ostype, id1, id2) = struct.unpack("!LBB", data[offset:offset + 6])
+        offset += 6
+        if offset >= length:
+            break
+        stringlen = data[offset]
+        offset += 1
+        if offset >= length:
+            break
+        string = data[offset:offset + stringlen]
+        offset += stringlen
+        if stringlen % 2 != 0:
+            offset += 1
+        if stringlen == 0:
+            offset += 1
+        if offset >= length:
+            break
+        size = struct.unpack("!L", data[offset:offset + 4])[0]
+        offset += 4
+        if offset >= length:
+            break
+        var = data[offset:offset + size]
+        offset += size
+        if size % 2 != 0:
+            offset += 1
+        if ((id1 << 8 | id2) == iptcinfo3.PADDING_RESOURCE_ID
+                and var.startswith(iptcinfo3.PADDING_SIGNATURE)
+                and not var[len(iptcinfo3.PADDING_SIGNATURE):].strip(b'\x00')):
+            continue
+        if not (id1 == 4 and id2 == 4):
+            out.append(struct.pack("!LBB", ostype, id1, id2))
+            out.append(struct.pack("B", stringlen))
+            out.append(string)
+            if stringlen == 0 or stringlen % 2 != 0:
+                out.append(struct.pack("B", 0))
+            out.append(struct.pack("!L", size))
+            out.append(var)
+            out = [b''.join(out)]
+            if size % 2 != 0 and len(out[0]) % 2 != 0:
+                out.append(struct.pack("B", 0))
+    return b''.join(out)
+
+
+def _app13_payload(fn):
+    (offset, length, data) = IPTCInfo(fn)._app13
+    assert data is None
+    with open(fn, 'rb') as fh:
+        fh.seek(offset)
+        return fh.read(length)
+
+
+def test_collect_adobe_parts_matches_legacy_output(tmp_path):
+    payloads = []
+    for fn in ['fixtures/Lenna.jpg', 'fixtures/instagram.jpg', 'fixtures/tagstest.jpeg']:
+        payloads.append(_app13_payload(fn))
+        # with a padding resource and a resource of odd size
+        IPTCInfo(fn).save_as(str(tmp_path / 'padded.jpg'), {'padding': 100})
+        payloads.append(_app13_payload(str(tmp_path / 'padded.jpg')))
+        odd = b'8BIM\x04\x0c\x00\x00' + struct.pack('>L', 3) + b'odd\x00'
+        payloads.append(payloads[-2] + odd + payloads[-2][14:])
+    rng = random.Random(0)
+    for payload in list(payloads):
+        for _ in range(20):
+            # cut anywhere, for truncated resources
+            payloads.append(payload[:rng.randrange(14, len(payload) + 1)])
+    for payload in payloads:
+        outputs = []
+        for collect in (collect_adobe_parts, _legacy_adobe_parts):
+            try:
+                outputs.append(collect(payload))
+            except struct.error:
+                # a size cut in half: both fail alike
+                outputs.append(struct.error)
+        assert outputs[0] == outputs[1]
+
+
+def test_collect_adobe_parts_drops_only_own_padding():
+    plugin = b'8BIM\x0f\xff\x00\x00' + struct.pack('>L', 8) + bytes(8)
+    thumbnail = b'8BIM\x04\x0c\x00\x00' + struct.pack('>L', 2) + b'ok'
+    data = b'Photoshop 3.0\x00' + plugin + photoshop_padding_resource(64) + thumbnail
+    assert collect_adobe_parts(data) == plugin + thumbnail
+
+
+def test_save_inplace_overwrites_app13_when_it_fits(tmp_path):
+    fn = _copy_fixture('instagram.jpg', tmp_path / 'inplace.jpg')
+
+    # the first save rewrites the file and reserves room
+    info = IPTCInfo(fn, force=True)
+    info['caption/abstract'] = b'short'
+    info.save(options={'inplace': True, 'padding': 256, 'overwrite': True})
+    size, inode = os.path.getsize(fn), os.stat(fn).st_ino
+
+    info = IPTCInfo(fn)
+    info['caption/abstract'] = b'a somewhat longer caption'
+    info['keywords'] = [b'foo', b'bar']
+    info.save(options={'inplace': True})
+    assert (os.path.getsize(fn), os.stat(fn).st_ino) == (size, inode)
+
+    info = IPTCInfo(fn)
+    assert info['caption/abstract'] == b'a somewhat longer caption'
+    assert info['keywords'] == [b'foo', b'bar']
+
+    # too big for the reserved room: falls back to a full rewrite
+    info['caption/abstract'] = b'x' * 1000
+    info.save(options={'inplace': True, 'overwrite': True})
+    assert os.path.getsize(fn) > size
+    assert IPTCInfo(fn)['caption/abstract'] == b'x' * 1000
+
+
+def test_photoshop_resources_index_app13(tmp_path):
+    fn = str(tmp_path / 'padded.jpg')
+    IPTCInfo('fixtures/instagram.jpg').save_as(fn, {'padding': 100})
+    info = IPTCInfo(fn)
+    resources = info.photoshop_resources
+    assert ([(rid, name) for (rid, name, offset, size) in resources]
+            == [(0x0404, b''), (0x0fff, b'')])
+    assert bytes(resources.get(0x0404)[:2]) == b'\x1c\x02'
+    assert isinstance(resources.get(0x0fff), memoryview)
+    with open(fn, 'rb') as fh:
+        for (i, (rid, name, offset, size)) in enumerate(resources):
+            fh.seek(offset)
+            assert fh.read(size) == resources.data(i)
+    assert resources.get(0x040c) is None
+    assert IPTCInfo('fixtures/instagram.jpg').photoshop_resources.find(0x0fff) is None
+    # only the location is kept for a named file; a file object is closed
+    # after scanning, so its data is kept
+    assert info._app13[2] is None
+    with open(fn, 'rb') as fh:
+        assert list(IPTCInfo(fh).photoshop_resources) == list(resources)
+    with open(fn, 'rb') as fh:
+        raw = fh.read()
+    # and an in-memory image is only referenced
+    info = IPTCInfo.from_bytes(raw)
+    assert info._app13[2].obj is raw
+    assert list(info.photoshop_resources) == list(resources)
+
+
+def test_save_as_reuses_scan_of_unchanged_file(tmp_path, monkeypatch):
+    fn = _copy_fixture('instagram.jpg', tmp_path / 'src.jpg')
+
+    calls = []
+
+    scan = iptcinfo3._jpeg_segment_scan
+
+    def index(fh, until):
+        calls.append(fh)
+        return scan(fh, until)
+
+    monkeypatch.setattr(iptcinfo3, '_jpeg_segment_scan', index)
+    info = IPTCInfo(fn)
+    # reading stops at APP13, which is all that saving needs
+    assert info._segments.resume is not None
+    info.save_as(str(tmp_path / 'reused.jpg'))
+    assert len(calls) == 1
+    assert info.segments.end is not None and len(calls) == 1
+
+    os.utime(fn, ns=(0, 0))
+    info.save_as(str(tmp_path / 'rescanned.jpg'))
+    assert len(calls) == 2
+
+    with open(tmp_path / 'reused.jpg', 'rb') as a, open(tmp_path / 'rescanned.jpg', 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_stats_record_phases_and_io(tmp_path, monkeypatch):
+    def no_hex_dump(dump):
+        raise AssertionError('hex_dump called with debug logging off')
+
+    monkeypatch.setattr(iptcinfo3, 'hex_dump', no_hex_dump)
+    seen = []
+    stats = IPTCStats(callback=lambda phase, seconds: seen.append(phase))
+    info = IPTCInfo('fixtures/instagram.jpg', stats=stats)
+    assert seen == ['jpegScan', 'collectIIMInfo']
+    assert stats.reads > 0 and stats.bytes_read > 0
+
+    out = str(tmp_path / 'out.jpg')
+    info.save_as(out)
+    assert seen[2:] == ['header', 'packedIIMData', 'write', 'move']
+    assert stats.bytes_written == os.path.getsize(out)
+    assert set(stats.to_dict()['phases']) == set(seen)
+
+
+def test_stats_keep_zero_copy_tail_of_in_memory_images(monkeypatch):
+    with open('fixtures/Lenna.jpg', 'rb') as fh:
+        raw = fh.read()
+    expected = IPTCInfo.from_bytes(raw).to_bytes()
+    # the block by block copy would take thousands of reads
+    monkeypatch.setattr(iptcinfo3, 'COPY_CHUNK', 1)
+    stats = IPTCStats()
+    info = IPTCInfo.from_bytes(raw, stats=stats)
+    out = io.BytesIO()
+    assert info.save_to(out)
+    assert out.getvalue() == expected
+    assert stats.reads < 100
+    assert stats.bytes_read >= len(raw)
+
+
+def test_stats_count_io_of_inplace_saves(tmp_path):
+    fn = _copy_fixture('instagram.jpg', tmp_path / 'src.jpg')
+    info = IPTCInfo(fn)
+    info['headline'] = b'padded'
+    info.save({'padding': 1024, 'overwrite': True})
+
+    stats = IPTCStats()
+    info = IPTCInfo(fn, stats=stats)
+    (read, size) = (stats.bytes_read, os.path.getsize(fn))
+    info['headline'] = b'in place'
+    assert info.save({'inplace': True}) is True
+    assert 'inplace' in stats.phases and 'write' not in stats.phases
+    (offset, length) = info.segments.find(0xed)
+    assert stats.bytes_written == length + 4
+    assert read < stats.bytes_read < size
+    assert os.path.getsize(fn) == size
+
+
+def test_cache_skips_parsing_unchanged_files(tmp_path, monkeypatch):
+    fn = _copy_fixture('instagram.jpg', tmp_path / 'src.jpg')
+    cache = IPTCCache(str(tmp_path / 'cache.sqlite'))
+    expected = IPTCInfo(fn, cache=cache).to_dict()
+    assert len(cache) == 1
+
+    def no_scan(self, fh):
+        raise AssertionError('cached file parsed again')
+
+    with monkeypatch.context() as m:
+        m.setattr(IPTCInfo, 'scanToFirstIMMTag', no_scan)
+        info = pickle.loads(pickle.dumps(cache)).get(fn)
+        assert info == expected
+        assert isinstance(IPTCInfo(fn, cache=cache)['keywords'], UniqueList)
+
+    info = IPTCInfo(fn, cache=cache)
+    info['headline'] = b'changed'
+    info.save_as(fn)
+    assert len(cache) == 0
+    assert cache.get(fn)['headline'] == b'changed'
+    cache.close()
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = IPTCCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    paths = []
+    for i in range(3):
+        paths.append(_copy_fixture('instagram.jpg', tmp_path / ('%d.jpg' % i)))
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+    assert len(cache) == 1
+    assert cache.lookup(paths[2])[1] is not None
+    assert cache.lookup(paths[1])[1] is None
+    cache.close()
+
+
+def test_cache_entries_per_inp_charset(tmp_path):
+    fn = _copy_fixture('instagram.jpg', tmp_path / 'src.jpg')
+    cache = IPTCCache(str(tmp_path / 'cache.sqlite'))
+    for _ in range(2):
+        raw = IPTCInfo(fn, cache=cache)
+        assert isinstance(raw['special instructions'], bytes) and raw.inp_charset is None
+        text = IPTCInfo(fn, cache=cache, inp_charset='latin1')
+        assert isinstance(text['special instructions'], str) and text.inp_charset == 'latin1'
+    assert len(cache) == 2
+
+    info = IPTCInfo(fn, cache=cache)
+    info['headline'] = b'changed'
+    info.save_as(fn)
+    assert len(cache) == 0
+    assert (cache._count, cache._bytes) == (0, 0)
+    cache.close()
+
+
+def test_cache_store_errors_dont_fail_reads(tmp_path, monkeypatch, caplog):
+    cache = IPTCCache(str(tmp_path / 'cache.sqlite'))
+
+    def locked(*args):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(cache, 'store', locked)
+    assert IPTCInfo('fixtures/instagram.jpg', cache=cache)['special instructions'] is not None
+    assert 'Could not cache' in caplog.text
+    cache.close()
+
+
+def test_index_updates_incrementally_and_searches(tmp_path, monkeypatch):
+    photos = tmp_path / 'photos'
+    (photos / 'sub').mkdir(parents=True)
+    for name in ('a.jpg', 'sub/b.jpg', 'sub/c.jpg'):
+        _copy_fixture('Lenna.jpg', photos / name)
+    info = IPTCInfo(str(photos / 'a.jpg'))
+    info['keywords'] = ['Cat', 'dog']
+    info['headline'] = 'A cat on the roof'
+    info.save()
+
+    index = IPTCIndex(str(tmp_path / 'index.sqlite'))
+    assert index.update([str(photos)]) == {
+        'added': 3, 'updated': 0, 'removed': 0, 'unchanged': 0, 'errors': 0}
+    a = os.path.abspath(str(photos / 'a.jpg'))
+    assert index.search(all=[('keywords', 'cat'), ('headline', 'the CAT')]) == [a]
+    assert len(index.search(any=[('keywords', 'dog'), ('keywords', 'lenna')])) == 3
+    assert index.search(all=[('keywords', 'lenna')], any=[('keywords', 'cat')]) == []
+
+    os.unlink(str(photos / 'sub' / 'c.jpg'))
+    info['keywords'] = ['bird']
+    info.save()
+    read = []
+    monkeypatch.setattr(iptcinfo3, 'read_many', lambda paths, **kwargs: [
+        (path, IPTCInfo(path).to_dict()) for path in paths if not read.append(path)])
+    assert index.update(iter([str(photos)])) == {
+        'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 1, 'errors': 0}
+    assert read == [a]
+    assert index.search(all=[('keywords', 'cat')]) == []
+    assert index.search(all=[('keywords', 'bird')]) == [a]
+    assert len(index) == 2
+    index.close()
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_read_many_reads_files_in_order_and_reports_errors(backend):
+    paths = ['fixtures/Lenna.jpg', 'fixtures/nonexistent.jpg', 'fixtures/instagram.jpg'] * 3
+    results = list(read_many(paths, workers=2, backend=backend, chunksize=2))
+
+    assert [path for (path, result) in results] == paths
+    assert results[0][1] == IPTCInfo('fixtures/Lenna.jpg').to_dict()
+    assert results[0][1]['keywords'] == [b'lenna', b'test']
+    assert isinstance(results[1][1], FileNotFoundError)
+
+    unordered = read_many(iter(paths), workers=3, backend=backend, ordered=False)
+    assert sorted(map(repr, unordered)) == sorted(map(repr, results))
+
+
+def test_read_columns_collects_rows_into_columns():
+    paths = ['fixtures/Lenna.jpg', 'fixtures/missing.jpg', 'fixtures/instagram.jpg']
+    table = read_columns(paths, fields=['keywords', 'caption/abstract', 'headline'], workers=2)
+    assert table.path == [paths[0], paths[2]]
+    assert [path for path, err in table.errors] == [paths[1]]
+    for i, path in enumerate(table.path):
+        expected = {name: value for name, value in IPTCInfo(path).to_dict().items()
+                    if name in table.fields}
+        assert table.row(i) == dict(expected, path=path)
+    assert list(table['keywords']) == [IPTCInfo(path)['keywords'] for path in table.path]
+
+    lenna = table.filter(b'lenna' in keywords for keywords in table['keywords'])
+    assert lenna.path == [paths[0]]
+    assert pickle.loads(pickle.dumps(table)).to_pydict() == table.to_pydict()
+
+
+def test_read_columns_to_arrow():
+    pa = pytest.importorskip('pyarrow')
+    table = read_columns(['fixtures/Lenna.jpg', 'fixtures/instagram.jpg'],
+                         fields=['keywords', 'headline'])
+    arrow = table.to_arrow()
+    assert arrow.schema.field('keywords').type == pa.large_list(pa.large_binary())
+    assert arrow.to_pydict() == table.to_pydict()
+
+
+def test_read_many_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        list(read_many(['fixtures/Lenna.jpg'], backend='fibers'))
+
+
+def test_write_many_updates_files_atomically(tmp_path):
+    paths = []
+    for i, name in enumerate(['Lenna.jpg', 'instagram.jpg'] * 2):
+        paths.append(_copy_fixture(name, tmp_path / ('%d.jpg' % i)))
+    inodes = [os.stat(path).st_ino for path in paths]
+
+    results = list(write_many(paths + [str(tmp_path / 'missing.jpg')],
+                              {'credit line': b'Agency', 'keywords': [b'bulk']}, workers=2))
+    assert [result for (path, result) in results[:-1]] == [True] * 4
+    assert isinstance(results[-1][1], FileNotFoundError)
+    for path, inode in zip(paths, inodes):
+        info = IPTCInfo(path)
+        assert info['credit line'] == b'Agency'
+        assert info['keywords'] == [b'bulk']
+        assert os.stat(path).st_ino != inode
+    assert sorted(os.listdir(tmp_path)) == ['0.jpg', '1.jpg', '2.jpg', '3.jpg']
+
+    results = write_many([(paths[0], {'headline': b'one'}), (paths[1], {'nonsense': b'two'})])
+    assert [type(result) for (path, result) in results] == [bool, KeyError]
+    assert IPTCInfo(paths[0])['headline'] == b'one'
+
+    # options can be a list of names, like for save_as
+    results = list(write_many(paths[:2], {'headline': b'listed'}, options=['overwrite']))
+    assert [result for (path, result) in results] == [True, True]
+    assert IPTCInfo(paths[1])['headline'] == b'listed'
+
+
+def test_write_many_skips_unchanged_files_and_coalesces(tmp_path):
+    paths = []
+    for i in range(3):
+        paths.append(_copy_fixture('Lenna.jpg', tmp_path / ('%d.jpg' % i)))
+    inodes = [os.stat(path).st_ino for path in paths]
+
+    counts = {}
+    edits = [(paths[0], {'headline': b'one'}), (paths[1], {'keywords': [b'lenna', b'test']}),
+             (paths[0], {'city': b'Here'}), (paths[2], {})]
+    results = dict(write_many(edits, counts=counts))
+    assert results == {paths[0]: True, paths[1]: UNCHANGED, paths[2]: UNCHANGED}
+    assert counts == {'written': 1, 'unchanged': 2}
+    assert ([os.stat(path).st_ino == inode for (path, inode) in zip(paths, inodes)]
+            == [False, True, True])
+    info = IPTCInfo(paths[0])
+    assert (info['headline'], info['city']) == (b'one', b'Here')
+
+
+def test_async_read_and_save(tmp_path):
+    fixtures = ['fixtures/Lenna.jpg', 'fixtures/instagram.jpg', 'setup.cfg']
+
+    async def main():
+        async with AsyncIPTCInfo(limit=2) as iptc:
+            infos = await asyncio.gather(*[iptc.read(fn, force=True) for fn in fixtures * 3])
+            info = await iptc.read(fixtures[1])
+            info['headline'] = b'async'
+            assert await iptc.save_as(info, str(tmp_path / 'out.jpg'))
+        return infos
+
+    infos = asyncio.run(main())
+    for fn, info in zip(fixtures * 3, infos):
+        assert info._data == IPTCInfo(fn, force=True)._data
+    assert IPTCInfo(str(tmp_path / 'out.jpg'))['headline'] == b'async'
+
+
+def test_async_read_walks_header_once_and_honours_kwargs(tmp_path, monkeypatch):
+    scan = iptcinfo3._jpeg_segment_scan
+    calls = []
+
+    def counted(fh, until):
+        calls.append(fh)
+        return scan(fh, until)
+
+    monkeypatch.setattr(iptcinfo3, '_jpeg_segment_scan', counted)
+    cache = IPTCCache(str(tmp_path / 'cache.sqlite'))
+
+    async def main():
+        async with AsyncIPTCInfo() as iptc:
+            info = await iptc.read('fixtures/instagram.jpg', lazy=True)
+            assert len(calls) == 1
+            cached = await iptc.read('fixtures/Lenna.jpg', cache=cache)
+        return (info, cached)
+
+    (info, cached) = asyncio.run(main())
+    assert info._parsed and info._data == IPTCInfo('fixtures/instagram.jpg')._data
+    assert cached._data == IPTCInfo('fixtures/Lenna.jpg')._data
+    assert len(cache) == 1
+
+
+def test_command_line_walks_directories(tmp_path, capsys):
+    (tmp_path / 'sub').mkdir()
+    for fn in ('a.jpg', 'sub/b.JPG', 'sub/notes.txt'):
+        _copy_fixture('Lenna.jpg', tmp_path / fn)
+
+    assert main([str(tmp_path), '--fields', 'keywords,headline', '-j', '2']) == 0
+    out = capsys.readouterr()
+    records = sorted(map(json.loads, out.out.splitlines()), key=lambda r: r['path'])
+    iptc = {'keywords': ['lenna', 'test'], 'headline': 'Headline'}
+    assert records == [
+        {'path': str(tmp_path / 'a.jpg'), 'iptc': iptc},
+        {'path': str(tmp_path / 'sub' / 'b.JPG'), 'iptc': iptc},
+    ]
+    assert out.err.startswith('2 files, 0 errors')
+
+    assert main([str(tmp_path), '--changed-since', '2999-01-01']) == 0
+    assert capsys.readouterr().out == ''
+
+    assert main(['-f', 'csv', '--fields', 'city',
+                 'fixtures/Lenna.jpg', 'fixtures/nonexistent.jpg']) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[:2] == ['path,error,city', 'fixtures/Lenna.jpg,,city']
+
+    with pytest.raises(SystemExit) as excinfo:
+        main(['--fields', 'keywords,keywrds', 'fixtures/Lenna.jpg'])
+    assert excinfo.value.code == 2
+    assert "unknown dataset 'keywrds' in --fields" in capsys.readouterr().err
+    assert lines[2].startswith('fixtures/nonexistent.jpg,FileNotFoundError')